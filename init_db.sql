@@ -2,15 +2,27 @@
 -- Place your DB schema initialization SQL here.
 -- Example: create tables for detections, alerts, analytics, zones
 
+-- detections mirrors src/database/models.py: RANGE-partitioned by day on
+-- timestamp (so timestamp is part of the primary key), jsonb bbox and the
+-- generated bbox bottom-center columns. Run `python -m src.database.init_db`
+-- after this file: it adds the model's indexes to existing tables (CREATE
+-- INDEX IF NOT EXISTS), the materialized views and the daily partitions, which
+-- the scheduler and the detection writers keep ahead. An existing unpartitioned detections table is
+-- converted with `python -m src.database.migrate_detections`.
 CREATE TABLE IF NOT EXISTS detections (
-  id SERIAL PRIMARY KEY,
-  camera_id TEXT,
-  class_name TEXT,
-  confidence REAL,
-  bbox TEXT,
+  id SERIAL,
+  camera_id VARCHAR(50),
+  timestamp TIMESTAMP NOT NULL,
+  class_name VARCHAR(50),
+  confidence DOUBLE PRECISION,
+  bbox JSONB,
   track_id INTEGER,
-  timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+  bbox_cx DOUBLE PRECISION GENERATED ALWAYS AS (
+    (COALESCE(bbox->>'x1', bbox->>0)::float + COALESCE(bbox->>'x2', bbox->>2)::float) / 2
+  ) STORED,
+  bbox_by DOUBLE PRECISION GENERATED ALWAYS AS (COALESCE(bbox->>'y2', bbox->>3)::float) STORED,
+  PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
 CREATE TABLE IF NOT EXISTS alerts (
   id SERIAL PRIMARY KEY,
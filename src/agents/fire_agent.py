@@ -3,10 +3,10 @@
 import os
 import json
 import logging
-from datetime import datetime, timedelta, timezone  # time window
+from datetime import datetime, timedelta  # time window
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, func, case
 from sqlalchemy.orm import sessionmaker
 
 from src.database.models import Detection, Alert
@@ -22,14 +22,20 @@ logger = logging.getLogger("fire_agent")
 
 # --- Database setup ---
 DATABASE_URL = (
-    f"postgresql://{os.getenv('POSTGRES_USER')}:"
+    f"postgresql+psycopg://{os.getenv('POSTGRES_USER')}:"
     f"{os.getenv('POSTGRES_PASSWORD')}@"
     f"{os.getenv('POSTGRES_HOST')}:"
     f"{os.getenv('POSTGRES_PORT')}/"
     f"{os.getenv('POSTGRES_DB')}"
 )
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=2,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"options": "-c statement_timeout=5000"},
+)
 SessionLocal = sessionmaker(bind=engine)
 
 # --- Config ---
@@ -43,8 +49,12 @@ def evaluate_window(session, camera_id: str):
     """
     Count fire/smoke detections for this camera in the last WINDOW_SEC seconds.
     Only recent detections from this run/video are used.
+    Classes below their MIN_*_COUNT threshold are dropped in SQL (HAVING),
+    so an idle window returns no rows.
+    Bounds are naive UTC to match detections.timestamp (TIMESTAMP WITHOUT
+    TIME ZONE), so PostgreSQL compares them without a per-row tz cast.
     """
-    now = datetime.now(timezone.utc)
+    now = datetime.utcnow()
     window_start = now - timedelta(seconds=WINDOW_SEC)
 
     logger.info(
@@ -66,11 +76,18 @@ def evaluate_window(session, camera_id: str):
             Detection.class_name.in_(["fire", "smoke"]),
         )
         .group_by(Detection.class_name)
+        .having(
+            func.count(Detection.id)
+            >= case(
+                (Detection.class_name == "fire", MIN_FIRE_COUNT),
+                else_=MIN_SMOKE_COUNT,
+            )
+        )
         .all()
     )
 
     if not rows:
-        logger.info("No fire/smoke detections in this window.")
+        logger.info("No fire/smoke detections above threshold in this window.")
         return
 
     counts = {r.class_name: r.cnt for r in rows}
@@ -95,6 +112,7 @@ def evaluate_window(session, camera_id: str):
             severity="critical",
             message=f"Fire detected: {fire_count} fire detections in last {WINDOW_SEC}s.",
             data=alert_payload,
+            timestamp=now,
         )
 
     if smoke_count >= MIN_SMOKE_COUNT:
@@ -105,8 +123,12 @@ def evaluate_window(session, camera_id: str):
             severity="warning",
             message=f"Smoke detected: {smoke_count} smoke detections in last {WINDOW_SEC}s.",
             data=alert_payload,
+            timestamp=now,
         )
 
+    # 0-2 alerts per window, persisted in a single commit
+    session.commit()
+
 
 def create_alert(
     session,
@@ -115,18 +137,18 @@ def create_alert(
     severity: str,
     message: str,
     data: dict,
+    timestamp: datetime,
 ):
     """
-    Insert an alert row using the actual Alert model fields:
+    Stage an alert row using the actual Alert model fields:
     alert_type, severity, camera_id, timestamp, extra, acknowledged.
+    The caller commits; timestamp is the window end it already computed.
     """
-    now = datetime.now(timezone.utc)
-
     alert = Alert(
         alert_type=alert_type,
         severity=severity,
         camera_id=camera_id,
-        timestamp=now,
+        timestamp=timestamp,
         extra={
             "message": message,
             "data": data,
@@ -135,7 +157,6 @@ def create_alert(
     )
 
     session.add(alert)
-    session.commit()
 
     logger.info(
         "Created %s alert (severity=%s) for camera=%s: %s",
@@ -1,5 +1,7 @@
 # src/agents/hf_llm.py
-from typing import Optional
+import hashlib
+import time
+from typing import Dict, Optional, Tuple
 from huggingface_hub import InferenceClient  # router-based client[web:98]
 
 
@@ -7,18 +9,34 @@ class SimpleHFLLM:
     """
     Minimal wrapper around Hugging Face InferenceClient.
     Exposes .invoke(prompt: str) -> str.
+
+    Requests time out after `timeout` seconds (the caller falls back to its
+    heuristic), and answers are cached by sha256(prompt) until the next hour.
     """
 
-    def __init__(self, model_id: str, api_token: Optional[str] = None):
+    def __init__(self, model_id: str, api_token: Optional[str] = None, timeout: float = 5.0):
         self.client = InferenceClient(
             model=model_id,
             token=api_token,
+            timeout=timeout,
         )
+        self._cache: Dict[str, Tuple[float, str]] = {}  # key -> (expires_at, text)
 
     def invoke(self, prompt: str) -> str:
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        now = time.time()
+        hit = self._cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+
         out = self.client.text_generation(
             prompt,
             max_new_tokens=64,
             temperature=0.4,
         )
+
+        # Prompts are built per hour, so an answer is valid until the next hour
+        next_hour = now - now % 3600 + 3600
+        self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        self._cache[key] = (next_hour, out)
         return out
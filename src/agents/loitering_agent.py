@@ -9,7 +9,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, func, and_, text
+from sqlalchemy import create_engine, and_, insert, select, true
 from sqlalchemy.orm import sessionmaker
 
 from src.database.models import TrackState, Alert
@@ -20,7 +20,7 @@ logger = logging.getLogger("loitering_agent")
 
 # Your .env POSTGRES_* vars
 DATABASE_URL = (
-    f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@"
+    f"postgresql+psycopg://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@"
     f"{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
 )
 
@@ -30,35 +30,57 @@ MIN_DETECTIONS = 5
 WINDOW_MINUTES = 15
 CAMERAS_TO_CHECK = ["CAM_001"]  # Add your cameras
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=2,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"options": "-c statement_timeout=5000"},
+)
 SessionLocal = sessionmaker(bind=engine)
 
 
 def get_loitering_tracks(session) -> List[Dict[str, Any]]:
-    """Query active tracks with long dwell time."""
+    """
+    Query active tracks with long dwell time.
+    Latest state per (camera_id, track_id) via LATERAL ... LIMIT 1, which walks
+    the ix_track_states_active_latest index instead of hash-aggregating the window.
+    """
     cutoff = datetime.utcnow() - timedelta(minutes=WINDOW_MINUTES)
-    
-    tracks = session.query(
-        TrackState.camera_id,
-        TrackState.track_id,
-        TrackState.zone_id,
-        TrackState.class_name,
-        func.max(TrackState.last_time).label("last_seen"),
-        func.max(TrackState.total_dwell_sec).label("dwell_sec"),
-        func.max(TrackState.detection_count).label("det_count"),
-        func.avg(TrackState.avg_speed).label("avg_speed")
-    ).filter(
-        and_(
-            TrackState.last_time >= cutoff,
-            TrackState.total_dwell_sec >= LOITER_THRESHOLD_SEC,
-            TrackState.detection_count >= MIN_DETECTIONS,
-            TrackState.status == "active"
+
+    keys = (
+        select(TrackState.camera_id, TrackState.track_id)
+        .where(TrackState.status == "active", TrackState.last_time >= cutoff)
+        .distinct()
+        .cte("keys")
+    )
+    latest = (
+        select(
+            TrackState.zone_id,
+            TrackState.class_name,
+            TrackState.last_time.label("last_seen"),
+            TrackState.total_dwell_sec.label("dwell_sec"),
+            TrackState.detection_count.label("det_count"),
+            TrackState.avg_speed,
+        )
+        .where(
+            and_(
+                TrackState.camera_id == keys.c.camera_id,
+                TrackState.track_id == keys.c.track_id,
+                TrackState.last_time >= cutoff,
+                TrackState.total_dwell_sec >= LOITER_THRESHOLD_SEC,
+                TrackState.detection_count >= MIN_DETECTIONS,
+                TrackState.status == "active"
+            )
         )
-    ).group_by(
-        TrackState.camera_id, TrackState.track_id, 
-        TrackState.zone_id, TrackState.class_name
-    ).order_by(
-        text("dwell_sec DESC")
+        .order_by(TrackState.last_time.desc())
+        .limit(1)
+        .lateral("latest")
+    )
+    tracks = session.execute(
+        select(keys.c.camera_id, keys.c.track_id, latest)
+        .select_from(keys.join(latest, true()))
+        .order_by(latest.c.dwell_sec.desc())
     ).all()
     
     result = []
@@ -77,26 +99,30 @@ def get_loitering_tracks(session) -> List[Dict[str, Any]]:
     return result
 
 
-def create_loitering_alert(session, track: Dict[str, Any]):
-    """Create Alert row (idempotent)."""
-    alert = Alert(
-        camera_id=track["camera_id"],
-        alert_type="loitering",
-        severity="medium",
-        description=(
-            f"Loitering: track {track['track_id']} ({track['class_name']}) "
-            f"zone {track['zone_id'] or 'none'}, {track['total_loiter_sec']}s dwell, "
-            f"{track['det_count']} dets, speed {track['avg_speed_pxs']:.1f}px/s"
-        ),
-        confidence=0.9,
-        track_id=track["track_id"]
+def build_loitering_alert(track: Dict[str, Any]) -> Dict[str, Any]:
+    """Build an alerts row for one loitering track (inserted in bulk by main)."""
+    description = (
+        f"Loitering: track {track['track_id']} ({track['class_name']}) "
+        f"zone {track['zone_id'] or 'none'}, {track['total_loiter_sec']}s dwell, "
+        f"{track['det_count']} dets, speed {track['avg_speed_pxs']:.1f}px/s"
     )
-    session.add(alert)
     logger.info(
         "🚨 LOITERING: %s track=%d zone=%s dwell=%ds speed=%.1f",
         track["camera_id"], track["track_id"], track["zone_id"],
         track["total_loiter_sec"], track["avg_speed_pxs"]
     )
+    return {
+        "camera_id": track["camera_id"],
+        "alert_type": "loitering",
+        "severity": "medium",
+        "extra": {
+            "message": description,
+            "track_id": track["track_id"],
+            "zone_id": track["zone_id"],
+            "total_loiter_sec": track["total_loiter_sec"],
+            "confidence": 0.9,
+        },
+    }
 
 
 def main():
@@ -106,10 +132,14 @@ def main():
         loiterers = get_loitering_tracks(session)
         logger.info("Found %d loitering tracks (threshold %ds)", len(loiterers), LOITER_THRESHOLD_SEC)
         
+        alerts = []
         for track in loiterers:
             logger.info("Suspicious: %s", track)
-            create_loitering_alert(session, track)
+            alerts.append(build_loitering_alert(track))
         
+        # One multi-row INSERT + one commit for the whole pass
+        if alerts:
+            session.execute(insert(Alert), alerts)
         session.commit()
     
     logger.info("✅ Loitering agent finished - check alerts table")
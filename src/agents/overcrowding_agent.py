@@ -1,13 +1,16 @@
 import asyncio
 import logging
 import os
+import sys
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Dict, List
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, func, distinct
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
+from src.database.aggregates import unique_track_count
 from src.database.models import Detection, Alert
 
 load_dotenv()
@@ -23,6 +26,22 @@ DATABASE_URL = (
     f"{os.getenv('POSTGRES_DB', 'hive_dynamics')}"
 )
 
+# One async pool per process, shared by every agent instance
+# (psycopg3 async driver, same URL as the sync agents)
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=2,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"options": "-c statement_timeout=5000"},
+)
+SessionLocal = async_sessionmaker(bind=engine)
+
+# psycopg's async mode can't run on Windows' default ProactorEventLoop;
+# set before any asyncio.run() that drives this engine
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
 # Simple per-camera capacity config (unique people allowed in window)
 CAMERA_CAPACITY: Dict[str, int] = {
     "CAM_001": int(os.getenv("CAM_001_MAX_OCCUPANCY", 40)),
@@ -33,19 +52,25 @@ WINDOW_MINUTES = int(os.getenv("OVERCROWDING_WINDOW_MINUTES", 10))
 HIGH_RATIO = float(os.getenv("OVERCROWDING_HIGH_RATIO", 1.5))
 MEDIUM_RATIO = float(os.getenv("OVERCROWDING_MEDIUM_RATIO", 1.0))
 
+# Opt-in: stream track_ids through a server-side cursor and dedupe client-side
+# (memory bounded by unique people, not rows) instead of COUNT(DISTINCT) in PG
+STREAM_DISTINCT = os.getenv("OVERCROWDING_STREAM_DISTINCT", "0") == "1"
+STREAM_BATCH_ROWS = 10000
+
 
 class OvercrowdingAgent:
     """
     Checks recent unique occupancy per camera and raises overcrowding alerts.
 
     - Window: last N minutes (WINDOW_MINUTES)
-    - Unique people: COUNT(DISTINCT track_id) from detections
+    - Unique people: COUNT(DISTINCT track_id) from detections, all cameras
+      in one GROUP BY camera_id query
     - Threshold: per-camera capacity from CAMERA_CAPACITY
     """
 
     def __init__(self):
-        self.engine = create_engine(DATABASE_URL)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = engine
+        self.Session = SessionLocal
         logger.info(
             "✅ OvercrowdingAgent initialized: window=%d min, high_ratio=%.2f, medium_ratio=%.2f",
             WINDOW_MINUTES,
@@ -53,29 +78,30 @@ class OvercrowdingAgent:
             MEDIUM_RATIO,
         )
 
-    def check_camera(self, camera_id: str) -> List[Dict]:
-        session = self.Session()
-        now = datetime.utcnow()
-        window_start = now - timedelta(minutes=WINDOW_MINUTES)
-
-        capacity = CAMERA_CAPACITY.get(camera_id)
-        if capacity is None:
-            logger.warning("No capacity configured for %s, skipping.", camera_id)
-            session.close()
-            return []
+    async def count_unique_people(
+        self, session, camera_ids: List[str], window_start: datetime, now: datetime
+    ) -> Dict[str, int]:
+        """Unique people per camera in the window, for all cameras in one round-trip."""
+        window = (
+            Detection.camera_id.in_(camera_ids),
+            Detection.class_name == "person",
+            Detection.track_id.isnot(None),  # matches detections_person_recent
+            Detection.timestamp >= window_start,
+            Detection.timestamp <= now,
+        )
+        if STREAM_DISTINCT:
+            return await self._stream_unique_tracks(session, window)
 
-        # Unique people in the recent window
-        unique_count = (
-            session.query(func.count(distinct(Detection.track_id)))
-            .filter(
-                Detection.camera_id == camera_id,
-                Detection.class_name == "person",
-                Detection.timestamp >= window_start,
-                Detection.timestamp <= now,
-            )
-            .scalar()
-        ) or 0
+        rows = await session.execute(
+            select(Detection.camera_id, unique_track_count(Detection.track_id))
+            .where(*window)
+            .group_by(Detection.camera_id)
+        )
+        return {camera_id: count for camera_id, count in rows}
 
+    def check_camera(self, session, camera_id: str, unique_count: int, now: datetime) -> List[Dict]:
+        """Apply the camera's capacity threshold; stages an Alert row if exceeded."""
+        capacity = CAMERA_CAPACITY[camera_id]
         ratio = unique_count / capacity if capacity > 0 else 0.0
         alerts: List[Dict] = []
 
@@ -110,7 +136,6 @@ class OvercrowdingAgent:
                 acknowledged=False,
             )
             session.add(alert_record)
-            session.commit()
 
             alerts.append(
                 {
@@ -127,17 +152,41 @@ class OvercrowdingAgent:
                 }
             )
             logger.warning("[%s] %s", camera_id, alerts[-1]["message"])
-        else:
-            session.commit()
 
-        session.close()
         return alerts
 
+    @staticmethod
+    async def _stream_unique_tracks(session, window) -> Dict[str, int]:
+        seen: Dict[str, set] = defaultdict(set)
+        result = await session.stream(
+            select(Detection.camera_id, Detection.track_id)
+            .where(*window)
+            .execution_options(yield_per=STREAM_BATCH_ROWS)
+        )
+        async for batch in result.partitions():
+            for camera_id, track_id in batch:
+                seen[camera_id].add(track_id)
+        return {camera_id: len(ids) for camera_id, ids in seen.items()}
+
     async def run(self, camera_ids: List[str]) -> List[Dict]:
+        now = datetime.utcnow()
+        window_start = now - timedelta(minutes=WINDOW_MINUTES)
+
+        cameras = [c for c in camera_ids if c in CAMERA_CAPACITY]
+        for cam in set(camera_ids) - set(cameras):
+            logger.warning("No capacity configured for %s, skipping.", cam)
+        if not cameras:
+            return []
+
         all_alerts: List[Dict] = []
-        for cam in camera_ids:
-            alerts = self.check_camera(cam)
-            all_alerts.extend(alerts)
+        async with self.Session() as session:
+            counts = await self.count_unique_people(session, cameras, window_start, now)
+            for cam in cameras:
+                all_alerts.extend(self.check_camera(session, cam, counts.get(cam, 0), now))
+
+            # One commit for every camera's alerts; nothing to commit otherwise
+            if all_alerts:
+                await session.commit()
         return all_alerts
 
 
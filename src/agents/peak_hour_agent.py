@@ -1,16 +1,21 @@
 # src/agents/peak_hour_agent.py
 import asyncio
 import logging
+import re
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import os
+import redis
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
-from sqlalchemy import create_engine, func, distinct
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
-from src.database.models import Detection, PeakHourAnalytics, Alert
+from src.database.aggregates import unique_track_count
+from src.database.models import Detection, PeakHourAnalytics, Alert, hourly_unique_person_counts
 from src.agents.state import PeakHourState
 from src.agents.hf_llm import SimpleHFLLM  # wrapper using InferenceClient
 
@@ -27,6 +32,49 @@ DATABASE_URL = (
     f"{os.getenv('POSTGRES_DB', 'hive_dynamics')}"
 )
 
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=2,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    # prepare_threshold=0: psycopg prepares every statement server-side on first
+    # use, so the per-camera queries of a run are bind+execute only after that
+    connect_args={"options": "-c statement_timeout=5000", "prepare_threshold": 0},
+)
+SessionLocal = sessionmaker(bind=engine)
+
+# Completed hours never change, so their unique counts are memoized in Redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+HOURLY_CACHE_TTL_SEC = 25 * 3600
+
+# hourly_unique_person_counts is refreshed by the agent before each run, at
+# most this often, so a miss never reads (and caches) a stale hour
+HOURLY_COUNTS_REFRESH_SEC = int(os.getenv("HOURLY_COUNTS_REFRESH_SEC", 60))
+
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+
+def refresh_hourly_counts():
+    """
+    REFRESH hourly_unique_person_counts at most once per HOURLY_COUNTS_REFRESH_SEC.
+    PeakHourAgent owns the view: every run calls this first, and concurrent
+    camera runs share one refresh.
+    """
+    global _last_refresh
+    with _refresh_lock:
+        if time.monotonic() - _last_refresh < HOURLY_COUNTS_REFRESH_SEC:
+            return
+        with engine.begin() as conn:
+            # The engine's 5 s statement_timeout is for the per-camera reads
+            conn.execute(text("SET LOCAL statement_timeout = '5min'"))
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY hourly_unique_person_counts"))
+        _last_refresh = time.monotonic()
+
+
+# First integer in the LLM reply
+_NUM_RE = re.compile(r"\d+")
+
 
 class PeakHourAgent:
     """
@@ -38,8 +86,8 @@ class PeakHourAgent:
     """
 
     def __init__(self):
-        self.engine = create_engine(DATABASE_URL)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = engine
+        self.Session = SessionLocal
 
         # Thresholds
         self.peak_threshold = int(os.getenv("PEAK_HOUR_THRESHOLD", 100))
@@ -53,59 +101,98 @@ class PeakHourAgent:
 
         self.llm = SimpleHFLLM(model_id=hf_model, api_token=hf_token) if hf_token else None
 
+        # Graph is static, so compile it once rather than on every run()
+        self.app = self.build_workflow().compile()
+
+        self.cache = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5)
+
         logger.info(
             "✅ PeakHourAgent initialized - peak_threshold=%d, low_threshold=%d",
             self.peak_threshold,
             self.low_threshold,
         )
 
+    # Redis helpers: a cache outage only costs a wider SQL range
+    def _cache_get(self, keys: List[str]) -> List[Optional[int]]:
+        try:
+            return [int(v) if v is not None else None for v in self.cache.mget(keys)]
+        except redis.RedisError as e:
+            logger.warning("Hourly count cache unavailable: %s", e)
+            return [None] * len(keys)
+
+    def _cache_set(self, values: Dict[str, int]) -> None:
+        if not values:
+            return
+        try:
+            pipe = self.cache.pipeline()
+            for key, count in values.items():
+                pipe.setex(key, HOURLY_CACHE_TTL_SEC, count)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Hourly count cache write failed: %s", e)
+
     # 1) AGGREGATION NODE
     def aggregate_hourly_count(self, state: PeakHourState) -> PeakHourState:
         """
         Aggregate UNIQUE person count for the current hour,
         and build a 24-hour history of unique counts.
         """
-        session = self.Session()
+        session = state["session"]
 
-        now = datetime.utcnow()
+        # Freeze the clock for the whole run so every node sees the same hour
+        now = state["now"] = datetime.utcnow()
         hour_start = now.replace(minute=0, second=0, microsecond=0)
         hour_end = hour_start + timedelta(hours=1)
 
-        # Unique people this hour: count distinct track_id
-        count = (
-            session.query(func.count(distinct(Detection.track_id)))
+        # Current hour: counted live from detections
+        state["person_count"] = (
+            session.query(unique_track_count(Detection.track_id))
             .filter(
                 Detection.camera_id == state["camera_id"],
                 Detection.class_name == "person",
+                Detection.track_id.isnot(None),  # matches detections_person_recent
                 Detection.timestamp >= hour_start,
                 Detection.timestamp < hour_end,
             )
             .scalar()
-        )
-
-        state["person_count"] = count or 0
+        ) or 0
         state["hour"] = hour_start.hour
 
-        # Unique people per hour for the last 24 hours (history)
-        last_24h: List[int] = []
-        for i in range(24):
-            h_start = hour_start - timedelta(hours=i + 1)
-            h_end = h_start + timedelta(hours=1)
-            hourly_count = (
-                session.query(func.count(distinct(Detection.track_id)))
+        # Completed hours: Redis first, then one indexed range read of the
+        # hourly_unique_person_counts materialized view for any misses
+        history = [hour_start - timedelta(hours=i) for i in range(24, 0, -1)]
+        keys = [f"peak:{state['camera_id']}:{h.isoformat()}" for h in history]
+        cached = self._cache_get(keys)
+        misses = [h for h, v in zip(history, cached) if v is None]
+
+        counts: Dict[datetime, int] = {}
+        if misses:
+            mv = hourly_unique_person_counts
+            counts = dict(
+                session.query(mv.c.h, mv.c.n)
                 .filter(
-                    Detection.camera_id == state["camera_id"],
-                    Detection.class_name == "person",
-                    Detection.timestamp >= h_start,
-                    Detection.timestamp < h_end,
+                    mv.c.camera_id == state["camera_id"],
+                    mv.c.h >= misses[0],
+                    mv.c.h < hour_start,
                 )
-                .scalar()
+                .all()
             )
-            last_24h.insert(0, hourly_count or 0)
+
+        # History oldest -> newest; hours without detections count as 0
+        last_24h: List[int] = [
+            v if v is not None else counts.get(h, 0) for h, v in zip(history, cached)
+        ]
+        self._cache_set(
+            {k: counts.get(h, 0) for k, h, v in zip(keys, history, cached) if v is None}
+        )
 
         state["hourly_counts"] = last_24h
         avg_24 = sum(last_24h) / 24 if last_24h else 0
 
+        # End the read transaction: the connection goes back to the pool instead
+        # of idling in transaction through the LLM forecast
+        session.commit()
+
         logger.info(
             "[%s] Hour %02d: unique_count=%d, avg_24h=%.1f",
             state["camera_id"],
@@ -114,7 +201,6 @@ class PeakHourAgent:
             avg_24,
         )
 
-        session.close()
         return state
 
     # 2) PEAK / LOW CLASSIFICATION NODE
@@ -137,15 +223,22 @@ class PeakHourAgent:
     def forecast_next_hour(self, state: PeakHourState) -> PeakHourState:
         """
         Forecast next hour's unique person count.
-        Uses HF LLM if available, otherwise falls back to last 3-hour average.
+        Uses HF LLM for peak hours if available, otherwise the last 3-hour average.
         """
         if len(state["hourly_counts"]) < 3:
             state["forecast"] = "0"
             return state
 
         avg_last_3h = sum(state["hourly_counts"][-3:]) / 3
-        current_hour = datetime.utcnow().hour
-        dow = datetime.utcnow().strftime("%A")
+
+        # Only a peak-hour alert surfaces the forecast (extra.forecast_next);
+        # otherwise the heuristic is enough for the analytics row
+        if not state["is_peak"]:
+            state["forecast"] = str(int(avg_last_3h))
+            return state
+
+        current_hour = state["now"].hour
+        dow = state["now"].strftime("%A")
         trend = (
             "increasing"
             if state["hourly_counts"][-1] > state["hourly_counts"][-2]
@@ -175,10 +268,8 @@ class PeakHourAgent:
 
         try:
             text = self.llm.invoke(prompt).strip()
-            import re
-
-            numbers = re.findall(r"\d+", text)
-            forecast = numbers[0] if numbers else str(int(avg_last_3h))
+            match = _NUM_RE.search(text)
+            forecast = match.group() if match else str(int(avg_last_3h))
             state["forecast"] = forecast
             logger.info(
                 "[%s] HF forecast next hour (unique visitors): %s",
@@ -194,10 +285,10 @@ class PeakHourAgent:
     # 4) ALERT & ANALYTICS NODE
     def trigger_alerts(self, state: PeakHourState) -> PeakHourState:
         """Write alerts and analytics to DB based on unique person count."""
-        session = self.Session()
+        session = state["session"]
         alerts: List[Dict] = []
 
-        now = datetime.utcnow()
+        now = state["now"]
         hour_start = now.replace(minute=0, second=0, microsecond=0)
 
         if state["is_peak"]:
@@ -275,7 +366,6 @@ class PeakHourAgent:
         )
         session.add(analytics)
         session.commit()
-        session.close()
 
         state["alerts"].extend(alerts)
         return state
@@ -297,30 +387,37 @@ class PeakHourAgent:
         return wf
 
     async def run(self, camera_id: str):
-        wf = self.build_workflow()
-        app = wf.compile()
-
         config = {
             "configurable": {
                 "thread_id": f"peak_hour_unique_{camera_id}_{datetime.now().strftime('%Y%m%d')}"
             }
         }
 
-        result = await asyncio.to_thread(
-            app.invoke,
-            {
-                "camera_id": camera_id,
-                "hour": 0,
-                "person_count": 0,
-                "hourly_counts": [],
-                "is_peak": False,
-                "is_low": False,
-                "forecast": "",
-                "alerts": [],
-                "messages": [],
-            },
-            config,
-        )
+        # Completed hours get cached from the view: make sure it has them all
+        await asyncio.to_thread(refresh_hourly_counts)
+
+        # One session for all nodes. It holds a connection only while a DB node
+        # runs: aggregate commits its reads, trigger_alerts commits its writes
+        session = self.Session()
+        try:
+            result = await asyncio.to_thread(
+                self.app.invoke,
+                {
+                    "camera_id": camera_id,
+                    "hour": 0,
+                    "person_count": 0,
+                    "hourly_counts": [],
+                    "is_peak": False,
+                    "is_low": False,
+                    "forecast": "",
+                    "alerts": [],
+                    "messages": [],
+                    "session": session,
+                },
+                config,
+            )
+        finally:
+            session.close()
         return result["alerts"]
 
 
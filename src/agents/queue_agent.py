@@ -2,19 +2,21 @@
 import asyncio
 import logging
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import List, Dict
 
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
 from sqlalchemy import func, distinct
 
-from src.database.models import Detection, Alert
+from src.database.models import Detection, Alert, queue_counts_mv
 from src.agents.state import QueueState
-from src.config.queue_rois import QUEUE_RECT_ROI, point_in_queue
+from src.config.queue_rois import QUEUE_RECT_ROI
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +37,71 @@ QUEUE_CRITICAL_THRESHOLD = int(os.getenv("QUEUE_CRITICAL_THRESHOLD", 20))
 QUEUE_WAIT_TIME_HIGH = int(os.getenv("QUEUE_WAIT_TIME_HIGH", 300))  # seconds
 QUEUE_SLOW_THROUGHPUT = float(os.getenv("QUEUE_SLOW_THROUGHPUT", 5.0))  # people/min
 QUEUE_THROUGHPUT_WINDOW_MINUTES = int(os.getenv("QUEUE_THROUGHPUT_WINDOW_MINUTES", 10))
+QUEUE_COUNTS_REFRESH_SEC = int(os.getenv("QUEUE_COUNTS_REFRESH_SEC", 5))  # view freshness
+
+# Hot path (runs per camera on a short interval): one pooled engine per process
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=10,
+    pool_pre_ping=False,
+    pool_recycle=3600,
+)
+SessionLocal = sessionmaker(bind=engine)
+
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+
+def refresh_queue_counts():
+    """
+    REFRESH queue_counts_mv (the throughput window's source) at most once per
+    QUEUE_COUNTS_REFRESH_SEC. QueueAgent owns the view: every run calls this
+    first, and concurrent camera runs share one refresh.
+    """
+    global _last_refresh
+    with _refresh_lock:
+        if time.monotonic() - _last_refresh < QUEUE_COUNTS_REFRESH_SEC:
+            return
+        with engine.begin() as conn:
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY queue_counts_mv"))
+        _last_refresh = time.monotonic()
+
+
+def _queue_counts(session, camera_id: str, short_start: datetime, long_start: datetime):
+    """
+    (in_queue, throughput_count): unique track_ids whose bbox bottom-center lies
+    in the camera's queue ROI since short_start and since long_start.
+    The short window is counted live on the generated bbox_cx / bbox_by
+    columns; the long window reads queue_counts_mv (minute buckets, refreshed
+    by refresh_queue_counts). Both come back in one round trip.
+    """
+    roi = QUEUE_RECT_ROI.get(camera_id)
+    if roi is None:
+        return 0, 0
+    x1, y1, x2, y2 = roi
+    live = (
+        session.query(func.count(distinct(Detection.track_id)))
+        .filter(
+            Detection.camera_id == camera_id,
+            Detection.class_name == "person",
+            Detection.track_id.isnot(None),  # matches detections_person_recent (index-only)
+            Detection.timestamp >= short_start,  # no upper bound: rows can't be in the future
+            Detection.bbox_cx.between(x1, x2),
+            Detection.bbox_by.between(y1, y2),
+        )
+        .scalar_subquery()
+    )
+    mv = queue_counts_mv
+    window = (
+        session.query(func.count(distinct(mv.c.track_id)))
+        .filter(
+            mv.c.camera_id == camera_id,
+            mv.c.bucket >= func.date_trunc("minute", long_start),
+        )
+        .scalar_subquery()
+    )
+    in_queue, throughput_count = session.query(live, window).one()
+    return in_queue or 0, throughput_count or 0
 
 
 class QueueAgent:
@@ -49,8 +116,10 @@ class QueueAgent:
     """
 
     def __init__(self):
-        self.engine = create_engine(DATABASE_URL)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = engine
+        self.Session = SessionLocal
+        # Graph is static, so compile it once rather than on every run()
+        self.app = self.build_workflow().compile()
         logger.info(
             "✅ QueueAgent initialized: window=%ds, buildup=%d, critical=%d",
             QUEUE_WINDOW_SECONDS,
@@ -58,132 +127,60 @@ class QueueAgent:
             QUEUE_CRITICAL_THRESHOLD,
         )
 
-    # NODE 1: DETECT_QUEUE_LINE
-    def detect_queue_line(self, state: QueueState) -> QueueState:
+    # NODE 1: COMPUTE_QUEUE_METRICS
+    def compute_queue_metrics(self, state: QueueState) -> QueueState:
         """
-        Load ROI for camera and count unique persons currently inside queue area
-        using recent detections.
+        Count unique persons currently inside the queue ROI and over the
+        throughput window in one query, then derive throughput and wait time.
         """
-        session = self.Session()
+        session = state["session"]
         now = datetime.utcnow()
         window_start = now - timedelta(seconds=QUEUE_WINDOW_SECONDS)
+        t_start = now - timedelta(minutes=QUEUE_THROUGHPUT_WINDOW_MINUTES)
 
         camera_id = state["camera_id"]
         roi_tuple = QUEUE_RECT_ROI.get(camera_id)
-        if not roi_tuple:
+        if roi_tuple:
+            x1, y1, x2, y2 = roi_tuple
+            # Store ROI as polygon-like list for completeness
+            state["queue_line_roi"] = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        else:
             logger.warning("No queue ROI configured for %s", camera_id)
-            state["people_in_queue"] = 0
-            state["queue_length"] = 0.0
-            session.close()
-            return state
-
-        x1, y1, x2, y2 = roi_tuple
-        # Store ROI as polygon-like list for completeness
-        state["queue_line_roi"] = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
 
-        # Fetch recent detections in window
-        detections = (
-            session.query(
-                Detection.track_id,
-                Detection.bbox,
-            )
-            .filter(
-                Detection.camera_id == camera_id,
-                Detection.class_name == "person",
-                Detection.timestamp >= window_start,
-                Detection.timestamp <= now,
-            )
-            .all()
-        )
-
-        # Unique track_ids whose bottom-center point lies in ROI
-        queue_ids = set()
-        for tid, bbox in detections:
-            if tid is None or bbox is None:
-                continue
-            x1b, y1b, x2b, y2b = bbox
-            cx = (x1b + x2b) / 2.0
-            cy = y2b  # bottom center
-            if point_in_queue(camera_id, cx, cy):
-                queue_ids.add(tid)
-
-        people_in_queue = len(queue_ids)
+        people_in_queue, total_customers = _queue_counts(session, camera_id, window_start, t_start)
         state["people_in_queue"] = people_in_queue
 
         # Rough queue length estimate: assume 0.75m per person
         state["queue_length"] = people_in_queue * 0.75
 
-        logger.info(
-            "[%s] Queue detect: people_in_queue=%d, est_length=%.2fm",
-            camera_id,
-            people_in_queue,
-            state["queue_length"],
-        )
-
-        session.close()
-        return state
-
-    # NODE 2: ESTIMATE_WAIT_TIME
-    def estimate_wait_time(self, state: QueueState) -> QueueState:
-        """
-        Estimate throughput and wait time using historical detections.
-        Simplified: approximate throughput from unique IDs in queue over a longer window.
-        """
-        session = self.Session()
-        camera_id = state["camera_id"]
-
-        now = datetime.utcnow()
-        t_start = now - timedelta(minutes=QUEUE_THROUGHPUT_WINDOW_MINUTES)
-
-        # Fetch detections in longer window
-        detections = (
-            session.query(Detection.track_id, Detection.bbox)
-            .filter(
-                Detection.camera_id == camera_id,
-                Detection.class_name == "person",
-                Detection.timestamp >= t_start,
-                Detection.timestamp <= now,
-            )
-            .all()
-        )
-
-        unique_ids = set()
-        for tid, bbox in detections:
-            if tid is None or bbox is None:
-                continue
-            x1b, y1b, x2b, y2b = bbox
-            cx = (x1b + x2b) / 2.0
-            cy = y2b
-            if point_in_queue(camera_id, cx, cy):
-                unique_ids.add(tid)
-
-        total_customers = len(unique_ids)
+        # Simplified: approximate throughput from unique IDs in queue over the longer window
         minutes = max(QUEUE_THROUGHPUT_WINDOW_MINUTES, 1)
         throughput = total_customers / minutes  # people per minute
 
         state["current_throughput"] = throughput
 
         if throughput > 0:
-            state["avg_wait_time"] = state["people_in_queue"] / throughput * 60.0
+            state["avg_wait_time"] = people_in_queue / throughput * 60.0
         else:
             state["avg_wait_time"] = float(QUEUE_WAIT_TIME_HIGH * 2)
 
         logger.info(
-            "[%s] Throughput=%.2f ppl/min, avg_wait_time≈%.1fs",
+            "[%s] Queue: people_in_queue=%d, est_length=%.2fm, throughput=%.2f ppl/min, avg_wait_time≈%.1fs",
             camera_id,
+            people_in_queue,
+            state["queue_length"],
             state["current_throughput"],
             state["avg_wait_time"],
         )
 
-        session.close()
         return state
 
-    # NODE 3: CHECK_ALERT_THRESHOLD
+    # NODE 2: CHECK_ALERT_THRESHOLD
     def check_alert_threshold(self, state: QueueState) -> QueueState:
         """
         Decide queue_status and write queue alerts if thresholds are exceeded.
         """
-        session = self.Session()
+        session = state["session"]
         camera_id = state["camera_id"]
         now = datetime.utcnow()
 
@@ -265,48 +262,50 @@ class QueueAgent:
                 throughput,
             )
 
-        session.close()
         state["alerts"].extend(alerts)
         return state
 
     # BUILD WORKFLOW
     def build_workflow(self) -> StateGraph:
         wf = StateGraph(QueueState)
-        wf.add_node("detect_queue_line", self.detect_queue_line)
-        wf.add_node("estimate_wait_time", self.estimate_wait_time)
+        wf.add_node("compute_queue_metrics", self.compute_queue_metrics)
         wf.add_node("check_alert_threshold", self.check_alert_threshold)
 
-        wf.set_entry_point("detect_queue_line")
-        wf.add_edge("detect_queue_line", "estimate_wait_time")
-        wf.add_edge("estimate_wait_time", "check_alert_threshold")
+        wf.set_entry_point("compute_queue_metrics")
+        wf.add_edge("compute_queue_metrics", "check_alert_threshold")
         wf.add_edge("check_alert_threshold", END)
         return wf
 
     async def run(self, camera_id: str):
-        wf = self.build_workflow()
-        app = wf.compile()
-
         config = {
             "configurable": {
                 "thread_id": f"queue_{camera_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
             }
         }
 
-        result = await asyncio.to_thread(
-            app.invoke,
-            {
-                "camera_id": camera_id,
-                "queue_line_roi": [],
-                "people_in_queue": 0,
-                "queue_length": 0.0,
-                "avg_wait_time": 0.0,
-                "current_throughput": 0.0,
-                "queue_status": "short",
-                "alerts": [],
-                "messages": [],
-            },
-            config,
-        )
+        await asyncio.to_thread(refresh_queue_counts)
+
+        # One session (one pool checkout) for all nodes; check_alert_threshold commits
+        session = self.Session()
+        try:
+            result = await asyncio.to_thread(
+                self.app.invoke,
+                {
+                    "camera_id": camera_id,
+                    "queue_line_roi": [],
+                    "people_in_queue": 0,
+                    "queue_length": 0.0,
+                    "avg_wait_time": 0.0,
+                    "current_throughput": 0.0,
+                    "queue_status": "short",
+                    "alerts": [],
+                    "messages": [],
+                    "session": session,
+                },
+                config,
+            )
+        finally:
+            session.close()
         return result["alerts"]
 
 
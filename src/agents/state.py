@@ -1,9 +1,11 @@
-from typing import TypedDict, List, Dict, Annotated
+from typing import TypedDict, List, Dict, Annotated, Any
 from langchain_core.messages import BaseMessage
 import operator
+from datetime import datetime
 
 class PeakHourState(TypedDict):
     camera_id: str
+    now: datetime  # frozen once per run by the entry node
     hour: int
     person_count: int
     hourly_counts: List[int]
@@ -12,6 +14,7 @@ class PeakHourState(TypedDict):
     forecast: str
     alerts: Annotated[List[Dict], operator.add]
     messages: Annotated[List[BaseMessage], operator.add]
+    session: Any  # one SQLAlchemy Session shared by every node of a run
 
 class OvercrowdingState(TypedDict):
     camera_id: str
@@ -32,3 +35,4 @@ class QueueState(TypedDict):
     queue_status: str  # "short", "medium", "long", "critical"
     alerts: List[Dict]
     messages: List[BaseMessage]
+    session: Any  # one SQLAlchemy Session shared by every node of a run
@@ -1,4 +1,5 @@
 # src/config/queue_rois.py
+import numpy as np
 
 # Simple rectangular queue zone per camera: (x1, y1, x2, y2)
 # NOTE: These coordinates are placeholders; tune them after you see the box on the video.
@@ -16,3 +17,28 @@ def point_in_queue(camera_id: str, x: float, y: float) -> bool:
         return False
     x1, y1, x2, y2 = roi
     return x1 <= x <= x2 and y1 <= y <= y2
+
+
+def roi_mask(camera_id: str, cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    """
+    Vectorized point_in_queue: boolean mask of which (cx[i], cy[i]) lie in the ROI.
+    """
+    cx = np.asarray(cx)
+    cy = np.asarray(cy)
+    roi = QUEUE_RECT_ROI.get(camera_id)
+    if roi is None:
+        return np.zeros(cx.shape, dtype=bool)
+    x1, y1, x2, y2 = roi
+    return (cx >= x1) & (cx <= x2) & (cy >= y1) & (cy <= y2)
+
+
+def count_in_queue(camera_id: str, bboxes: np.ndarray, track_ids: np.ndarray) -> int:
+    """
+    Unique track_ids whose bbox bottom-center lies in the ROI, for rows already
+    in memory (N×4 xyxy bboxes, N track_ids); one mask + np.unique, no Python loop.
+    """
+    bb = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+    cx = (bb[:, 0] + bb[:, 2]) * 0.5
+    cy = bb[:, 3]
+    mask = roi_mask(camera_id, cx, cy)
+    return int(np.unique(np.asarray(track_ids)[mask]).size)
@@ -1,12 +1,49 @@
 import os
+import torch
 from ultralytics import YOLO
 import cv2
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
 import logging
 
 logger = logging.getLogger(__name__)
 
+# OpenCV's own thread pool only competes with PyTorch's; the pipeline threads are enough
+cv2.setNumThreads(1)
+
+
+def load_yolo(weights: str) -> Tuple[YOLO, Union[int, str], bool]:
+    """
+    Load YOLO weights for inference (YOLOHFDetector and FireSmokeDetector).
+    Returns (model, device, half): FP16 on CUDA, BatchNorm folded into conv once.
+    """
+    model = YOLO(weights)
+    device = 0 if torch.cuda.is_available() else "cpu"
+    half = device == 0
+    model.fuse()
+    return model, device, half
+
+
+def predict_boxes(model: YOLO, frames: List[np.ndarray], conf: float,
+                  device: Union[int, str], half: bool) -> List[Tuple[List, List, List]]:
+    """
+    One forward pass over all frames. Per frame, in order: (class_ids, confidences,
+    xyxy boxes) as Python lists.
+    """
+    with torch.inference_mode():
+        results = model.predict(frames, conf=conf, device=device, half=half, verbose=False)
+
+    batch = []
+    for r in results:
+        # One device->host transfer per attribute, not one sync per box
+        batch.append((
+            r.boxes.cls.cpu().numpy().astype(np.int32).tolist(),
+            r.boxes.conf.cpu().numpy().tolist(),
+            r.boxes.xyxy.cpu().numpy().tolist(),
+        ))
+    return batch
+
+
 class YOLOHFDetector:
     """
     Object detector using Ultralytics YOLO11 weights from Hugging Face Hub.
@@ -24,9 +61,9 @@ class YOLOHFDetector:
         
         try:
             # Ultralytics YOLO automatically pulls from HF Hub if not local
-            self.model = YOLO(model_id)
+            self.model, self.device, self.half = load_yolo(model_id)
             self.conf_threshold = conf_threshold
-            logger.info(f"✅ YOLO11 (HF) loaded: {model_id}")
+            logger.info(f"✅ YOLO11 (HF) loaded: {model_id} (device={self.device}, half={self.half})")
         except Exception as e:
             logger.error(f"❌ Failed to load YOLO model: {e}")
             raise
@@ -38,38 +75,47 @@ class YOLOHFDetector:
         Returns:
             List of detections with bbox, class, confidence, class_id
         """
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames: List[np.ndarray]) -> List[List[Dict]]:
+        """
+        Run detection on several frames in one forward pass.
+        
+        Returns:
+            One detection list per frame, in input order
+        """
         try:
-            results = self.model.predict(frame, conf=self.conf_threshold, verbose=False)[0]
+            batch: List[List[Dict]] = []
+            for cls_arr, conf_arr, xyxy in predict_boxes(
+                self.model, frames, self.conf_threshold, self.device, self.half
+            ):
+                detections: List[Dict] = []
+                for cls_id, conf, bbox in zip(cls_arr, conf_arr, xyxy):
+                    cls_name = self.model.names[cls_id]
+                    detections.append({
+                        'class': cls_name,
+                        'confidence': conf,
+                        'bbox': bbox,
+                        'class_id': cls_id
+                    })
+                batch.append(detections)
             
-            detections: List[Dict] = []
-            for box in results.boxes:
-                cls_id = int(box.cls)
-                cls_name = self.model.names[cls_id]
-                detections.append({
-                    'class': cls_name,
-                    'confidence': float(box.conf),
-                    'bbox': box.xyxy[0].cpu().numpy().tolist(),
-                    'class_id': cls_id
-                })
-            
-            return detections
+            return batch
         except Exception as e:
             logger.error(f"Detection error: {e}")
-            return []
+            return [[] for _ in frames]
 
     def draw_detections(self, frame: np.ndarray, detections: List[Dict]) -> np.ndarray:
-        """Draw bounding boxes and labels on frame"""
-        annotated = frame.copy()
-        
+        """Draw bounding boxes and labels on frame, in place (copy first if the original is needed)"""
         for det in detections:
             x1, y1, x2, y2 = map(int, det['bbox'])
             label = f"{det['class']} {det['confidence']:.2f}"
             
-            cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(annotated, label, (x1, max(0, y1 - 8)),
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(frame, label, (x1, max(0, y1 - 8)),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         
-        return annotated
+        return frame
 
 # Test
 if __name__ == "__main__":
@@ -1,23 +1,23 @@
 # src/cv_pipeline/fire_smoke_processor.py
 
+import asyncio
 import cv2
-import json
 import time
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import List, Dict
 import os
 
 from dotenv import load_dotenv
+from psycopg.types.json import Jsonb
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from ultralytics import YOLO
 
-from src.database.models import Detection
+from src.cv_pipeline.detector import load_yolo, predict_boxes
+from src.database.init_db import ensure_detection_partitions_daily
 
 load_dotenv()
 
 DATABASE_URL = (
-    f"postgresql://{os.getenv('POSTGRES_USER')}:"
+    f"postgresql+psycopg://{os.getenv('POSTGRES_USER')}:"
     f"{os.getenv('POSTGRES_PASSWORD')}@"
     f"{os.getenv('POSTGRES_HOST')}:"
     f"{os.getenv('POSTGRES_PORT')}/"
@@ -25,7 +25,30 @@ DATABASE_URL = (
 )
 
 engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+
+# Detections are buffered and written with one COPY per flush
+COPY_DETECTIONS_SQL = (
+    "COPY detections (camera_id, timestamp, class_name, confidence, bbox, track_id) FROM STDIN"
+)
+FLUSH_ROWS = 128
+FLUSH_SEC = 1.0
+
+
+def flush_detections(rows: List[tuple]) -> None:
+    """Write buffered detection rows with a single psycopg COPY, then clear the buffer."""
+    if not rows:
+        return
+    ensure_detection_partitions_daily()
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            with cur.copy(COPY_DETECTIONS_SQL) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        conn.commit()
+    finally:
+        conn.close()
+    rows.clear()
 
 
 class FireSmokeDetector:
@@ -35,30 +58,32 @@ class FireSmokeDetector:
     """
 
     def __init__(self, weights_path: str, conf_threshold: float = 0.5):
-        self.model = YOLO(weights_path)
+        self.model, self.device, self.half = load_yolo(weights_path)
         self.conf_threshold = conf_threshold
 
     def detect(self, frame) -> List[Dict]:
+        """Single-frame path (test harness); see detect_batch."""
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames: List) -> List[List[Dict]]:
         """
-        Returns detections as:
+        One forward pass over all frames; returns one detection list per frame, each as:
         [
           {"class_name": "fire", "confidence": 0.92, "bbox": [x1,y1,x2,y2], "color": (0,0,255)},
           {"class_name": "smoke", "confidence": 0.88, "bbox": [...],        "color": (255,255,0)},
           ...
         ]
         """
-        results = self.model(frame, conf=self.conf_threshold, verbose=False)
-        detections: List[Dict] = []
+        batch: List[List[Dict]] = []
+        names = self.model.names  # {class_id: name}
 
-        for r in results:
-            boxes = r.boxes
-            names = r.names  # {class_id: name}
+        for cls_arr, conf_arr, xyxy in predict_boxes(
+            self.model, frames, self.conf_threshold, self.device, self.half
+        ):  # one entry per frame, in order
+            detections: List[Dict] = []
 
-            for box in boxes:
-                cls_id = int(box.cls.item())
+            for cls_id, conf, (x1, y1, x2, y2) in zip(cls_arr, conf_arr, xyxy):
                 cls_name = names.get(cls_id, "object").lower()
-                conf = float(box.conf.item())
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
 
                 if cls_name in ["fire", "flame", "open_flame"]:
                     cls_norm = "fire"
@@ -77,8 +102,115 @@ class FireSmokeDetector:
                         "color": color,
                     }
                 )
+            batch.append(detections)
+
+        return batch
+
+
+PIPELINE_QUEUE_SIZE = 4
+DETECT_BATCH = int(os.getenv("FIRE_SMOKE_BATCH", 4))  # frames per forward pass
+
+
+def read_sampled(cap, step: int):
+    """Return every `step`-th frame; skipped frames are grab()bed, not decoded to BGR."""
+    for _ in range(step - 1):
+        if not cap.grab():
+            return None
+    ret, frame = cap.read()
+    return frame if ret else None
+
+
+def annotate_and_buffer(camera_id: str, frame, detections: List[Dict], ts, pending: List[tuple]):
+    """Buffer rows for COPY and draw boxes in place: the frame is not reused, so no copy."""
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        color = det["color"]
+        label = f"{det['class_name']} {det['confidence']:.2f}"
+
+        # Buffer for the detections table (psycopg adapts bbox to jsonb)
+        pending.append((
+            camera_id,
+            ts,
+            det["class_name"],   # 'fire' or 'smoke'
+            det["confidence"],
+            Jsonb(det["bbox"]),
+            None,                # track_id
+        ))
+
+        # Draw on frame
+        p1 = (int(x1), int(y1))
+        p2 = (int(x2), int(y2))
+        cv2.rectangle(frame, p1, p2, color, 2)
+        cv2.putText(
+            frame,
+            label,
+            (p1[0], max(0, p1[1] - 10)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            color,
+            2,
+            cv2.LINE_AA,
+        )
+
+    return frame
+
+
+async def run_pipeline(camera_id: str, cap, detector: FireSmokeDetector, writer, step: int):
+    """
+    capture -> detect -> persist/write as three tasks joined by bounded queues,
+    so decode, inference and DB/disk writes overlap. Blocking calls run in
+    worker threads; None on a queue marks end of stream.
+    """
+    cap_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    det_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
 
-        return detections
+    async def capture():
+        while True:
+            frame = await asyncio.to_thread(read_sampled, cap, step)
+            if frame is None:
+                await cap_q.put(None)
+                return
+            ts = datetime.utcnow()  # naive UTC, like every other detections writer
+            await cap_q.put((frame, ts))
+
+    async def detect():
+        done = False
+        while not done:
+            # Block for one frame, then take whatever else is already queued
+            items = [await cap_q.get()]
+            while len(items) < DETECT_BATCH and not cap_q.empty():
+                items.append(cap_q.get_nowait())
+            if items[-1] is None:
+                items.pop()
+                done = True
+
+            if items:
+                frames = [frame for frame, _ in items]
+                batch = await asyncio.to_thread(detector.detect_batch, frames)
+                for (frame, ts), detections in zip(items, batch):
+                    await det_q.put((frame, detections, ts))
+        await det_q.put(None)
+
+    async def persist():
+        pending: List[tuple] = []
+        last_flush = time.time()
+        try:
+            while True:
+                item = await det_q.get()
+                if item is None:
+                    return
+                frame, detections, ts = item
+                annotated = annotate_and_buffer(camera_id, frame, detections, ts, pending)
+
+                now = time.time()
+                if len(pending) >= FLUSH_ROWS or now - last_flush >= FLUSH_SEC:
+                    await asyncio.to_thread(flush_detections, pending)
+                    last_flush = now
+                await asyncio.to_thread(writer.write, annotated)
+        finally:
+            flush_detections(pending)
+
+    await asyncio.gather(capture(), detect(), persist())
 
 
 def process_stream(camera_id: str, source: str, fps: float = 1.0):
@@ -90,7 +222,6 @@ def process_stream(camera_id: str, source: str, fps: float = 1.0):
     conf = float(os.getenv("FIRE_SMOKE_CONF", 0.5))
 
     detector = FireSmokeDetector(weights_path=weights, conf_threshold=conf)
-    session = SessionLocal()
 
     # Prepare annotated video writer -> data/output/<CAM_ID>_fire_annotated.mp4
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
@@ -103,61 +234,13 @@ def process_stream(camera_id: str, source: str, fps: float = 1.0):
 
     writer = cv2.VideoWriter(out_path, fourcc, fps, (width, height))
 
-    frame_interval = 1.0 / fps
-    last_time = 0.0
+    # Sample `fps` frames per second of video instead of spin-reading on a timer
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or fps
+    step = max(1, round(source_fps / fps))
 
     try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            now = time.time()
-            if now - last_time < frame_interval:
-                continue
-            last_time = now
-
-            detections = detector.detect(frame)
-            ts = datetime.now(timezone.utc)
-
-            annotated = frame.copy()
-
-            for det in detections:
-                x1, y1, x2, y2 = det["bbox"]
-                color = det["color"]
-                label = f"{det['class_name']} {det['confidence']:.2f}"
-
-                # Insert into detections table
-                row = Detection(
-                    camera_id=camera_id,
-                    timestamp=ts,
-                    class_name=det["class_name"],   # 'fire' or 'smoke'
-                    confidence=det["confidence"],
-                    bbox=json.dumps(det["bbox"]),
-                    track_id=None,                  # or 0 if NOT NULL
-                )
-                session.add(row)
-
-                # Draw on frame
-                p1 = (int(x1), int(y1))
-                p2 = (int(x2), int(y2))
-                cv2.rectangle(annotated, p1, p2, color, 2)
-                cv2.putText(
-                    annotated,
-                    label,
-                    (p1[0], max(0, p1[1] - 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    color,
-                    2,
-                    cv2.LINE_AA,
-                )
-
-            session.commit()
-            writer.write(annotated)
-
+        asyncio.run(run_pipeline(camera_id, cap, detector, writer, step))
     finally:
-        session.close()
         cap.release()
         writer.release()
         print(f"Annotated fire/smoke video saved to: {out_path}")
@@ -4,15 +4,15 @@ Handles list/JSON bbox, ANY class_name, scales to millions.
 """
 
 import os
-import json
 import logging
+from itertools import groupby
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
-from math import sqrt
-from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
 
+import numpy as np
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, func, and_, text
+from sqlalchemy import create_engine, func, and_, text, select, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 
 from src.database.models import Detection, TrackState
@@ -25,50 +25,45 @@ DATABASE_URL = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_
 
 WINDOW_HOURS = 1  # Scale: process last 1hr
 MIN_DETECTIONS = 3
+STREAM_BATCH_ROWS = 10000  # server-side cursor fetch size
+UPSERT_BATCH_ROWS = 1000
+# Conflict key + insert-only columns, left untouched when a track is updated
+UPSERT_KEEP_COLUMNS = ("id", "camera_id", "track_id", "zone_id", "created_at", "updated_at")
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
 
 
-def parse_bbox(bbox_data) -> Tuple[float, float, float, float]:
-    """Universal bbox parser."""
-    try:
-        if isinstance(bbox_data, str):
-            bbox = json.loads(bbox_data)
-        else:
-            bbox = bbox_data
-        
-        # List [x1,y1,x2,y2]
-        if isinstance(bbox, list) and len(bbox) >= 4:
-            return float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])
-        # Dict {"x1":100,...}
-        elif isinstance(bbox, dict):
-            return (float(bbox.get('x1',0)), float(bbox.get('y1',0)), 
-                   float(bbox.get('x2',0)), float(bbox.get('y2',0)))
-        else:
-            return 0.0, 0.0, 0.0, 0.0
-    except Exception as e:
-        logger.debug("bbox parse fail %s: %s", bbox_data, e)
-        return 0.0, 0.0, 0.0, 0.0
-
-
-def get_recent_detections(session) -> List[Detection]:
-    """Scale to millions - person/vehicle only."""
+def get_recent_detections(session) -> Iterator[Row]:
+    """Scale to millions - person/vehicle only. Streams column tuples, no ORM objects."""
     cutoff = datetime.utcnow() - timedelta(hours=WINDOW_HOURS)
-    dets = session.query(Detection).filter(
+    stmt = select(
+        Detection.camera_id, Detection.track_id, Detection.class_name,
+        Detection.timestamp, Detection.bbox_cx, Detection.bbox_by,
+    ).where(
         Detection.timestamp >= cutoff,
         Detection.track_id.isnot(None),
-        Detection.class_name.ilike('%person%')  # person/people/pedestrian
+        Detection.class_name == 'person'  # writers store the exact COCO name; sargable
     ).order_by(
         Detection.camera_id, Detection.track_id, Detection.timestamp
-    ).all()
-    
-    logger.info("📊 Loaded %d detections (%.1f/sec avg)", 
-               len(dets), len(dets)/(WINDOW_HOURS*3600))
-    return dets
+    ).execution_options(stream_results=True, yield_per=STREAM_BATCH_ROWS)
 
+    return session.execute(stmt)
 
-def compute_metrics(track_dets: List[Detection]) -> Dict:
+
+def iter_tracks(dets: Iterable[Row]) -> Iterator[List[Row]]:
+    """Rows arrive ordered by (camera, track, time): single-pass groupby on a tuple key."""
+    n = 0
+    for _, group in groupby(dets, key=lambda d: (d.camera_id, d.track_id)):
+        track_dets = list(group)
+        n += len(track_dets)
+        yield track_dets
+
+    logger.info("📊 Streamed %d detections (%.1f/sec avg)",
+               n, n/(WINDOW_HOURS*3600))
+
+
+def compute_metrics(track_dets: List[Row]) -> Dict:
     """Full track analysis."""
     n = len(track_dets)
     if n < MIN_DETECTIONS:
@@ -79,45 +74,55 @@ def compute_metrics(track_dets: List[Detection]) -> Dict:
     
     # Time
     times = [d.timestamp for d in track_dets]
-    dwell = int((max(times) - min(times)).total_seconds())
-    
-    # Speed (center trajectory)
-    centers = [parse_bbox(d.bbox)[:2] for d in track_dets]  # (cx,cy)
-    speeds = []
-    for i in range(1, n):
-        dx = centers[i][0] - centers[i-1][0]
-        dy = centers[i][1] - centers[i-1][1]
-        dist = sqrt(dx**2 + dy**2)
-        dt = (track_dets[i].timestamp - track_dets[i-1].timestamp).total_seconds()
-        speeds.append(dist/dt if dt > 0 else 0)
-    
-    avg_speed = sum(speeds)/len(speeds) if speeds else 0
+    dwell = int((times[-1] - times[0]).total_seconds())  # rows are time-ordered
+
+    # Speed (bottom-center trajectory, from the generated bbox columns: no bbox parsing)
+    t = np.fromiter((ts.timestamp() for ts in times), dtype=np.float64, count=n)
+    centers = np.nan_to_num(np.array([(d.bbox_cx, d.bbox_by) for d in track_dets], dtype=np.float64))
+    steps = np.diff(centers, axis=0)
+    dts = np.diff(t)
+    speeds = np.where(dts > 0, np.hypot(steps[:, 0], steps[:, 1]) / np.where(dts > 0, dts, 1), 0.0)
+
+    avg_speed = float(speeds.mean()) if speeds.size else 0
     
     # Zone (speed-based for now)
     zone_id = 1 if avg_speed < 5 else None
     
     return dict(
         camera_id=camera, track_id=track_id, zone_id=zone_id,
-        class_name=cls, enter_time=min(times), last_time=max(times),
+        class_name=cls, enter_time=times[0], last_time=times[-1],
         total_dwell_sec=dwell, detection_count=n, avg_speed=avg_speed,
         status='loitering' if dwell > 120 else 'active'
     )
 
 
+def upsert_track_states(session, metrics: List[Dict]):
+    """INSERT ... ON CONFLICT (camera, track, zone) DO UPDATE, in batches: no read-before-write."""
+    stmt = pg_insert(TrackState)
+    stmt = stmt.on_conflict_do_update(
+        constraint="unique_track_zone",
+        set_={
+            **{
+                c.name: stmt.excluded[c.name]
+                for c in TrackState.__table__.c
+                if c.name not in UPSERT_KEEP_COLUMNS
+            },
+            "updated_at": func.timezone("utc", func.now()),
+        },
+    )
+    for i in range(0, len(metrics), UPSERT_BATCH_ROWS):
+        session.execute(stmt, metrics[i:i + UPSERT_BATCH_ROWS])
+
+
 def process_tracks():
     """Production: million-scale track processing."""
     session = SessionLocal()
     try:
         dets = get_recent_detections(session)
-        tracks = defaultdict(list)
-        
-        # O(n) grouping
-        for d in dets:
-            key = f"{d.camera_id}_{d.track_id}"
-            tracks[key].append(d)
-        
+
+        # One streaming pass: peak memory is one track, not the whole window
         metrics = []
-        for key, track_dets in tracks.items():
+        for track_dets in iter_tracks(dets):
             m = compute_metrics(track_dets)
             if m:
                 metrics.append(m)
@@ -128,9 +133,7 @@ def process_tracks():
             TrackState.last_time < cutoff
         ).delete()
         
-        for m in metrics:
-            session.merge(TrackState(**m))
-        
+        upsert_track_states(session, metrics)
         session.commit()
         
         active = len([m for m in metrics if m['status']=='active'])
@@ -1,9 +1,17 @@
 import numpy as np
+from collections import defaultdict
+from scipy.optimize import linear_sum_assignment
 from typing import List, Dict
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Track bboxes are bucketed into GRID_CELL x GRID_CELL pixel cells each frame,
+# so a detection is only compared with tracks sharing a cell with it
+GRID_CELL = 128
+# Below this many (detection, track) pairs a dense broadcast IoU is cheaper than bucketing
+DENSE_IOU_MAX_PAIRS = 1024
+
 class ByteTracker:
     def __init__(self, track_thresh: float = 0.5, match_thresh: float = 0.8, max_age: int = 30):
         self.track_thresh = track_thresh
@@ -13,24 +21,30 @@ class ByteTracker:
         self.max_age = max_age
         logger.info("✅ ByteTracker initialized")
 
+    def has_active_tracks(self) -> bool:
+        return bool(self.tracks)
+
     def update(self, detections: List[Dict], frame_id: int) -> List[Dict]:
         high_conf = [d for d in detections if d["confidence"] > self.track_thresh]
         tracked_objects = []
 
-        for detection in high_conf:
-            best_match_id = None
-            best_iou = 0.0
-
-            for track_id, track in list(self.tracks.items()):
-                iou = self._calculate_iou(detection["bbox"], track["bbox"])
-                if iou > self.match_thresh and iou > best_iou:
-                    best_iou = iou
-                    best_match_id = track_id
+        # One-to-one Hungarian matching on the detection x track IoU matrix
+        matches = {}
+        if high_conf and self.tracks:
+            track_ids = list(self.tracks)
+            det_boxes = np.asarray([d["bbox"] for d in high_conf], dtype=np.float32)
+            trk_boxes = np.asarray([self.tracks[t]["bbox"] for t in track_ids], dtype=np.float32)
+            iou = self._grid_iou_matrix(det_boxes, trk_boxes)
+            rows, cols = linear_sum_assignment(-iou)
+            for r, c in zip(rows, cols):
+                if iou[r, c] > self.match_thresh:
+                    matches[r] = track_ids[c]
 
-            if best_match_id:
-                self.tracks[best_match_id]["bbox"] = detection["bbox"]
-                self.tracks[best_match_id]["last_seen"] = frame_id
-                track_id = best_match_id
+        for i, detection in enumerate(high_conf):
+            track_id = matches.get(i)
+            if track_id is not None:
+                self.tracks[track_id]["bbox"] = detection["bbox"]
+                self.tracks[track_id]["last_seen"] = frame_id
             else:
                 track_id = self.next_id
                 self.tracks[track_id] = {"bbox": detection["bbox"], "last_seen": frame_id}
@@ -45,20 +59,45 @@ class ByteTracker:
         }
         return tracked_objects
 
-    def _calculate_iou(self, box1: List[float], box2: List[float]) -> float:
-        x1_1, y1_1, x2_1, y2_1 = box1
-        x1_2, y1_2, x2_2, y2_2 = box2
+    @staticmethod
+    def _cell_range(box: np.ndarray):
+        x1, y1, x2, y2 = (box // GRID_CELL).astype(int)
+        return range(x1, x2 + 1), range(y1, y2 + 1)
+
+    def _grid_iou_matrix(self, det_boxes: np.ndarray, trk_boxes: np.ndarray) -> np.ndarray:
+        """NxM IoU matrix, computed only for (detection, track) pairs sharing a grid cell."""
+        if len(det_boxes) * len(trk_boxes) <= DENSE_IOU_MAX_PAIRS:
+            return self._pair_iou(det_boxes[:, None, :], trk_boxes[None, :, :])
+
+        grid = defaultdict(list)
+        for j, box in enumerate(trk_boxes):
+            xs, ys = self._cell_range(box)
+            for cx in xs:
+                for cy in ys:
+                    grid[(cx, cy)].append(j)
+
+        det_idx, trk_idx = [], []
+        for i, box in enumerate(det_boxes):
+            xs, ys = self._cell_range(box)
+            candidates = {j for cx in xs for cy in ys for j in grid.get((cx, cy), ())}
+            det_idx.extend([i] * len(candidates))
+            trk_idx.extend(candidates)
 
-        x1_i = max(x1_1, x1_2)
-        y1_i = max(y1_1, y1_2)
-        x2_i = min(x2_1, x2_2)
-        y2_i = min(y2_1, y2_2)
+        iou = np.zeros((len(det_boxes), len(trk_boxes)), dtype=np.float32)
+        if det_idx:
+            iou[det_idx, trk_idx] = self._pair_iou(det_boxes[det_idx], trk_boxes[trk_idx])
+        return iou
 
-        if x2_i < x1_i or y2_i < y1_i:
-            return 0.0
+    @staticmethod
+    def _pair_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Element-wise IoU of xyxy box arrays (...x4), broadcasting like NumPy."""
+        xi1 = np.maximum(a[..., 0], b[..., 0])
+        yi1 = np.maximum(a[..., 1], b[..., 1])
+        xi2 = np.minimum(a[..., 2], b[..., 2])
+        yi2 = np.minimum(a[..., 3], b[..., 3])
+        inter = np.clip(xi2 - xi1, 0, None) * np.clip(yi2 - yi1, 0, None)
 
-        intersection = (x2_i - x1_i) * (y2_i - y1_i)
-        area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-        area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union = area1 + area2 - intersection
-        return intersection / union if union > 0 else 0.0
+        area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+        area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+        union = area_a + area_b - inter
+        return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
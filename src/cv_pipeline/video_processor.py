@@ -4,39 +4,247 @@ Clean data for ALL agents + loitering.
 """
 
 import os
+import queue
+import shutil
+import subprocess
+import threading
 import time
 import cv2
+import numpy as np
+import torch
 from datetime import datetime
-from typing import Set
+from functools import lru_cache
+from typing import Dict, List, Set
+
+from psycopg.types.json import Jsonb
+from sqlalchemy import insert
 
 from src.cv_pipeline.detector import YOLOHFDetector
 from src.cv_pipeline.tracker import ByteTracker
-from src.database.init_db import get_db_session
+from src.database.init_db import ensure_detection_partitions_daily, get_db_session
 from src.database.models import Detection
-from src.config.queue_rois import QUEUE_RECT_ROI
+from src.config.queue_rois import QUEUE_RECT_ROI, count_in_queue
 
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+FLUSH_ROWS = 500
+FLUSH_SEC = 2.0
+# Core statement on the table: plain dict rows, no ORM unit-of-work per flush
+INSERT_DETECTIONS = insert(Detection.__table__)
+# batch_mode (offline backfill): buffer until end of file, then COPY
+COPY_DETECTIONS_SQL = (
+    "COPY detections (camera_id, timestamp, class_name, confidence, bbox, track_id) FROM STDIN"
+)
+COPY_FLUSH_ROWS = 50000  # memory cap for very long files
+FRAME_RING_SLOTS = 8  # preallocated frames shared by reader → main → writer
+DETECT_BATCH = int(os.getenv("DETECT_BATCH", 4))  # frames per YOLO forward pass
+
+# Read by OpenCV's FFmpeg backend when a capture is opened: 2 decoder threads
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "threads;2")
+
+# Annotated output: H.264 via an ffmpeg subprocess (NVENC on GPU hosts) instead
+# of OpenCV's software mp4v encoder. FFMPEG_VIDEO_CODEC forces an encoder; each
+# candidate is test-encoded first, and cv2.VideoWriter is the last resort
+FFMPEG_VIDEO_CODEC = os.getenv("FFMPEG_VIDEO_CODEC")
+FFMPEG_PRESETS = {"h264_nvenc": "p1", "libx264": "veryfast"}
+
+
+@lru_cache(maxsize=None)
+def _ffmpeg_encoder_works(codec: str) -> bool:
+    """Encode a few synthetic frames: a listed encoder can still lack its GPU or driver."""
+    try:
+        probe = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", "color=size=256x256:duration=0.2",
+             "-c:v", codec, "-pix_fmt", "yuv420p", "-f", "null", "-"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return probe.returncode == 0
+
+
+def _pick_ffmpeg_codec():
+    """First working ffmpeg encoder, or None when ffmpeg is missing or none works."""
+    if not shutil.which("ffmpeg"):
+        return None
+    candidates = [FFMPEG_VIDEO_CODEC] if FFMPEG_VIDEO_CODEC else []
+    if torch.cuda.is_available():
+        candidates.append("h264_nvenc")
+    candidates.append("libx264")
+    for codec in dict.fromkeys(candidates):
+        if _ffmpeg_encoder_works(codec):
+            return codec
+        logger.warning(f"ffmpeg encoder {codec} unavailable, trying the next one")
+    return None
+
+
+class FFmpegWriter:
+    """cv2.VideoWriter-compatible sink that pipes raw BGR frames to ffmpeg."""
+
+    def __init__(self, out_path: str, fps: float, width: int, height: int,
+                 codec: str = "libx264"):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            # yuv420p needs even dimensions: pad odd frames by one pixel
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-c:v", codec,
+        ]
+        if codec in FFMPEG_PRESETS:
+            cmd += ["-preset", FFMPEG_PRESETS[codec]]
+        cmd += ["-pix_fmt", "yuv420p", out_path]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        if self.proc.poll() is not None:
+            raise RuntimeError(f"ffmpeg exited with code {self.proc.returncode}")
+        self.proc.stdin.write(frame.tobytes())
+
+    def release(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg already exited; write() reported it
+        self.proc.wait()
+
+
+def open_video_writer(out_path: str, fps: float, width: int, height: int):
+    """FFmpegWriter on the first working encoder, else OpenCV's mp4v writer."""
+    codec = _pick_ffmpeg_codec()
+    if codec:
+        return FFmpegWriter(out_path, fps, width, height, codec)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(out_path, fourcc, fps, (width, height))
+
+
 class VideoProcessor:
-    def __init__(self, camera_id: str, source: str, save_video: bool = True):
+    def __init__(self, camera_id: str, source: str, save_video: bool = True, show: bool = False):
         self.camera_id = camera_id
         self.source = source
         self.save_video = save_video
+        self.show = show  # cv2.imshow preview window; off for unattended runs
+        # Live feeds can't be read faster than real time; files are decoder-limited
+        self.is_live = isinstance(source, int) or str(source).startswith(
+            ("rtsp://", "rtmp://", "http://", "https://", "/dev/")
+        )
         self.detector = YOLOHFDetector(conf_threshold=0.5)  # Clean detections
         self.tracker = ByteTracker()
         self.frame_id = 0
 
-    def run(self, save_to_db: bool = True):
+    @staticmethod
+    def _flush(db, pending: List[Dict], copy: bool = False):
+        if not pending:
+            return
+        ensure_detection_partitions_daily()
+        if copy:
+            # Backfill path: one COPY FROM STDIN on the session's own connection
+            with db.connection().connection.cursor() as cur:
+                with cur.copy(COPY_DETECTIONS_SQL) as cp:
+                    for r in pending:
+                        cp.write_row((
+                            r['camera_id'], r['timestamp'], r['class_name'],
+                            r['confidence'], Jsonb(r['bbox']), r['track_id'],
+                        ))
+        else:
+            db.connection().execute(INSERT_DETECTIONS, pending)
+        db.commit()
+        pending.clear()
+
+    @staticmethod
+    def _take_slot(free_q: queue.Queue, read_q: queue.Queue, stop: threading.Event, live: bool):
+        """Next ring-buffer slot to decode into, or None (stopped / live feed with no slot free)."""
+        if live:
+            # Never stall a live feed: reuse the oldest queued frame's slot instead
+            for q in (free_q, read_q):
+                try:
+                    return q.get_nowait()
+                except queue.Empty:
+                    pass
+            return None
+        while not stop.is_set():
+            try:
+                return free_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    @staticmethod
+    def _read_frames(cap, slots: np.ndarray, free_q: queue.Queue, read_q: queue.Queue,
+                     stop: threading.Event, live: bool):
+        """Reader thread: decode ahead of detection into free slots; None marks end of stream."""
+        try:
+            while not stop.is_set():
+                idx = VideoProcessor._take_slot(free_q, read_q, stop, live)
+                if idx is None:
+                    if live and not cap.grab():  # every slot in flight: skip this frame
+                        return
+                    continue
+                slot = slots[idx]
+                ret, out = cap.read(slot)  # decodes in place when the frame fits the slot
+                if not ret:
+                    return
+                if out is not slot:
+                    # Decoder allocated a new array (frame size/format changed): fit it in
+                    if out.ndim == 2:
+                        out = cv2.cvtColor(out, cv2.COLOR_GRAY2BGR)
+                    if out.shape != slot.shape:
+                        out = cv2.resize(out, (slot.shape[1], slot.shape[0]))
+                    np.copyto(slot, out)
+                read_q.put(idx)
+        finally:
+            read_q.put(None)  # also on a decode error, so the main loop never waits forever
+
+    @staticmethod
+    def _write_frames(writer, slots: np.ndarray, write_q: queue.Queue, free_q: queue.Queue,
+                      errors: List[Exception]):
+        """
+        Writer thread: encode off the main thread, then recycle the slot; None ends.
+        A failed write lands in `errors` for the main loop; slots are always recycled.
+        """
+        while (idx := write_q.get()) is not None:
+            try:
+                if not errors:
+                    writer.write(slots[idx])
+            except Exception as e:
+                logger.error(f"Video writer failed: {e}")
+                errors.append(e)
+            finally:
+                free_q.put(idx)
+
+    def _open_capture(self):
+        """FFmpeg backend with any available hardware decoder (falls back to software)."""
+        if isinstance(self.source, int):
+            return cv2.VideoCapture(self.source)  # local device: not an FFmpeg source
+        return cv2.VideoCapture(
+            self.source,
+            cv2.CAP_FFMPEG,
+            [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY],
+        )
+
+    def run(self, save_to_db: bool = True, batch_mode: bool = False):
+        """
+        batch_mode: offline backfill of a recorded file. Rows are held until
+        end of file (or COPY_FLUSH_ROWS) and loaded with COPY instead of INSERT.
+        """
         print(f"🎯 N unique people → N detections: {self.source}")
-        cap = cv2.VideoCapture(self.source)
+        cap = self._open_capture()
         if not cap.isOpened():
             print(f"❌ Cannot open: {self.source}")
             return
         
         fps = cap.get(cv2.CAP_PROP_FPS) or 25
-        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Size the ring buffer and writer from a decoded frame: the capture's
+        # FRAME_WIDTH/HEIGHT properties can disagree with it (RTSP, some containers)
+        ret, first = cap.read()
+        if not ret:
+            print(f"❌ No frames: {self.source}")
+            cap.release()
+            return
+        height, width = first.shape[:2]
         
         db = get_db_session() if save_to_db else None
         
@@ -45,8 +253,7 @@ class VideoProcessor:
         if self.save_video:
             os.makedirs("data/output", exist_ok=True)
             out_path = f"data/output/{self.camera_id}_unique.mp4"
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            writer = cv2.VideoWriter(out_path, fourcc, fps, (width, height))
+            writer = open_video_writer(out_path, fps, width, height)
             print(f"💾 {out_path}")
         
         # UNIQUE TRACKS ONLY (N people = N rows)
@@ -54,75 +261,160 @@ class VideoProcessor:
         total_unique = 0
         
         logger.info(f"Processing {self.camera_id} - unique only")
+
+        # Detection rows are buffered and inserted in one executemany per flush
+        pending: List[Dict] = []
+        last_flush = time.time()
+        
+        # reader thread → main (detect/track/DB/display) → writer thread.
+        # Detector and tracker stay on the main thread (one CUDA context).
+        # Frames live in a preallocated ring of slots; the queues carry slot
+        # indices, and the free list bounds how many frames are in flight.
+        slots = np.empty((FRAME_RING_SLOTS, *first.shape), dtype=first.dtype)
+        slots[0] = first
+        free_q: queue.Queue = queue.Queue()
+        for idx in range(1, FRAME_RING_SLOTS):
+            free_q.put(idx)
+        read_q: queue.Queue = queue.Queue()
+        read_q.put(0)
+        write_q: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self._read_frames,
+            args=(cap, slots, free_q, read_q, stop, self.is_live),
+            daemon=True,
+        )
+        reader.start()
+        encoder = None
+        write_errors: List[Exception] = []
+        if writer:
+            encoder = threading.Thread(
+                target=self._write_frames,
+                args=(writer, slots, write_q, free_q, write_errors),
+                daemon=True,
+            )
+            encoder.start()
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+        done = False
+        try:
+            while not done:
+                if write_errors:
+                    raise RuntimeError(f"Annotated video writer failed: {write_errors[0]}")
+                # Micro-batch: block for one frame, then take what is already decoded
+                batch = [read_q.get()]
+                while len(batch) < DETECT_BATCH:
+                    try:  # a live reader may drain read_q between checks
+                        batch.append(read_q.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                if not batch:
+                    break
             
-            self.frame_id += 1
+                # DETECT (one forward pass) → TRACK (per frame, in order)
+                batch_dets = self.detector.detect_batch([slots[i] for i in batch])
             
-            # DETECT → TRACK
-            dets = self.detector.detect(frame)
-            tracked = self.tracker.update(dets, self.frame_id)
+                for idx, dets in zip(batch, batch_dets):
+                    frame = slots[idx]
+                
+                    self.frame_id += 1
             
-            # SAVE UNIQUE PEOPLE ONLY (1 row/track_id)
-            if db and tracked:
-                for obj in tracked:
-                    if obj.get('class') != 'person':
-                        continue
+                    # Empty scene with nothing left to age out: nothing for the tracker to do
+                    if not dets and not self.tracker.has_active_tracks():
+                        tracked = []
+                    else:
+                        tracked = self.tracker.update(dets, self.frame_id)
+                    now = datetime.utcnow()  # one timestamp per frame, shared by its rows
+            
+                    # SAVE UNIQUE PEOPLE ONLY (1 row/track_id)
+                    if db and tracked:
+                        for obj in tracked:
+                            if obj.get('class') != 'person':
+                                continue
                         
-                    tid = int(obj.get('track_id') or 0)
-                    if tid == 0 or tid in unique_tracks:
-                        continue  # Already saved this person
+                            tid = int(obj.get('track_id') or 0)
+                            if tid == 0 or tid in unique_tracks:
+                                continue  # Already saved this person
                     
-                    unique_tracks.add(tid)
-                    total_unique += 1
+                            unique_tracks.add(tid)
+                            total_unique += 1
                     
-                    # 1 ROW PER UNIQUE PERSON
-                    rec = Detection(
-                        camera_id=self.camera_id,
-                        timestamp=datetime.utcnow(),
-                        class_name='person',
-                        confidence=float(obj['confidence']),
-                        bbox=str(obj['bbox']),  # List [x1,y1,x2,y2]
-                        track_id=tid
-                    )
-                    db.add(rec)
-                
-                db.commit()
+                            # 1 ROW PER UNIQUE PERSON
+                            pending.append(dict(
+                                camera_id=self.camera_id,
+                                timestamp=now,
+                                class_name='person',
+                                confidence=float(obj['confidence']),
+                                bbox=obj['bbox'],  # List [x1,y1,x2,y2] → jsonb array
+                                track_id=tid
+                            ))
             
-            # VISUALIZE
-            vis = self.detector.draw_detections(frame, tracked)
+                    # Track ids are never reused and expired tracks can't come back, so only
+                    # ids still alive in the tracker need remembering: memory stays O(active)
+                    if self.frame_id % self.tracker.max_age == 0:
+                        unique_tracks.intersection_update(self.tracker.tracks)
             
-            # STATS
-            cv2.putText(vis, f"Unique: {total_unique}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
+                    if db and batch_mode:
+                        if len(pending) >= COPY_FLUSH_ROWS:
+                            self._flush(db, pending, copy=True)
+                    elif db and (len(pending) >= FLUSH_ROWS or time.time() - last_flush >= FLUSH_SEC):
+                        self._flush(db, pending)
+                        last_flush = time.time()
+            
+                    # VISUALIZE: only when someone will see it (annotated file or preview)
+                    if writer or self.show:
+                        vis = self.detector.draw_detections(frame, tracked)
+                
+                        # STATS
+                        cv2.putText(vis, f"Unique: {total_unique}", (10, 30), 
+                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
+                
+                        # ROI + live queue occupancy (tracked people standing in it)
+                        roi = QUEUE_RECT_ROI.get(self.camera_id)
+                        if roi:
+                            x1,y1,x2,y2 = roi
+                            cv2.rectangle(vis, (x1,y1), (x2,y2), (255,0,0), 2)
+                            people = [o for o in tracked if o.get('class') == 'person' and o.get('track_id')]
+                            in_queue = count_in_queue(
+                                self.camera_id, [o['bbox'] for o in people], [o['track_id'] for o in people]
+                            )
+                            cv2.putText(vis, f"In queue: {in_queue}", (x1, max(0, y1 - 10)),
+                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
             
-            # ROI
-            roi = QUEUE_RECT_ROI.get(self.camera_id)
-            if roi:
-                x1,y1,x2,y2 = roi
-                cv2.rectangle(vis, (x1,y1), (x2,y2), (255,0,0), 2)
+                    if self.show:
+                        cv2.imshow(f"Hive-{self.camera_id}", vis)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            done = True
+                            break
             
+                    # Hand the slot on only when done with it: the reader reuses freed slots
+                    if writer:
+                        write_q.put(idx)  # writer thread frees the slot after encoding
+                    else:
+                        free_q.put(idx)
+        finally:
+            # Always stop the threads, release devices and keep the buffered rows
+            stop.set()
+            reader.join()
+            cap.release()
             if writer:
-                writer.write(vis)
-            cv2.imshow(f"Hive-{self.camera_id}", vis)
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-            time.sleep(1/fps)
-        
-        cap.release()
-        if writer:
-            writer.release()
-        cv2.destroyAllWindows()
-        if db:
-            db.close()
+                write_q.put(None)
+                encoder.join()
+                writer.release()
+            if self.show:
+                cv2.destroyAllWindows()
+            if db:
+                try:
+                    self._flush(db, pending, copy=batch_mode)
+                finally:
+                    db.close()
         
         print(f"✅ {total_unique} UNIQUE people → {total_unique} detections")
 
 
 if __name__ == "__main__":
-    vp = VideoProcessor("CAM_001", "data/videos/test.mp4", save_video=True)
-    vp.run()
+    show = os.getenv("VIDEO_DISPLAY", "0") == "1"  # preview window; off when headless
+    vp = VideoProcessor("CAM_001", "data/videos/test.mp4", save_video=True, show=show)
+    vp.run(batch_mode=True)  # recorded file: COPY at end of file
@@ -0,0 +1,23 @@
+"""
+Shared SQL aggregate expressions for the agents.
+"""
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import Integer, cast, distinct, func
+
+load_dotenv()
+
+# Approximate distinct counts via the postgresql-hll extension (O(1) memory,
+# ~2% error). Requires `CREATE EXTENSION hll`, which init_db() runs when set.
+USE_HLL_DISTINCT = os.getenv("USE_HLL_DISTINCT", "0") == "1"
+
+
+def unique_track_count(column):
+    """
+    COUNT(DISTINCT column), or its HyperLogLog estimate when USE_HLL_DISTINCT=1.
+    """
+    if USE_HLL_DISTINCT:
+        estimate = func.hll_cardinality(func.hll_add_agg(func.hll_hash_integer(column)))
+        return cast(func.round(func.coalesce(estimate, 0)), Integer)
+    return func.count(distinct(column))
@@ -1,11 +1,103 @@
+import logging
 import os
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex
 
-from src.database.models import Base
+from src.database.models import Base, Detection, TrackState
+from src.database.aggregates import USE_HLL_DISTINCT
+from src.config.queue_rois import QUEUE_RECT_ROI
 
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Same setting QueueAgent reads: the throughput window queue_counts_mv must cover
+QUEUE_COUNTS_WINDOW_MINUTES = int(os.getenv("QUEUE_THROUGHPUT_WINDOW_MINUTES", 10))
+
+
+def _queue_roi_values() -> str:
+    rows = ", ".join(
+        f"('{cam}', {x1}, {y1}, {x2}, {y2})" for cam, (x1, y1, x2, y2) in QUEUE_RECT_ROI.items()
+    )
+    return f"(VALUES {rows}) AS roi (camera_id, x1, y1, x2, y2)"
+
+
+# Derived objects create_all() does not manage; every statement is idempotent
+POST_CREATE_DDL = [
+    # Unique people per camera per hour for PeakHourAgent's 24h history. Only
+    # the last 25 hours are kept (24 completed + the current one), so a refresh
+    # reads one or two daily partitions instead of the retention period
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS hourly_unique_person_counts AS
+    SELECT camera_id, date_trunc('hour', timestamp) AS h, COUNT(DISTINCT track_id) AS n
+    FROM detections
+    WHERE class_name = 'person'
+      AND timestamp >= date_trunc('hour', timezone('utc', now())) - interval '24 hours'
+    GROUP BY 1, 2
+    """,
+    # Unique index: required by REFRESH ... CONCURRENTLY, serves (camera, hour) lookups
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS hourly_unique_person_counts_cam_h
+    ON hourly_unique_person_counts (camera_id, h)
+    """,
+    # QueueAgent throughput window: distinct person tracks inside the queue ROI
+    # per minute. Track rows (not per-minute counts) so a window's COUNT(DISTINCT)
+    # stays exact. Only the window QueueAgent reads is kept, so each refresh
+    # scans the newest partition, not the retention period. ROIs and the window
+    # are baked in: DROP the view after changing either
+    f"""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS queue_counts_mv AS
+    SELECT DISTINCT d.camera_id, date_trunc('minute', d.timestamp) AS bucket, d.track_id
+    FROM detections d
+    JOIN {_queue_roi_values()} ON roi.camera_id = d.camera_id
+    WHERE d.class_name = 'person' AND d.track_id IS NOT NULL
+      AND d.timestamp >= date_trunc('minute', timezone('utc', now()))
+                         - interval '{QUEUE_COUNTS_WINDOW_MINUTES} minutes'
+      AND d.bbox_cx BETWEEN roi.x1 AND roi.x2
+      AND d.bbox_by BETWEEN roi.y1 AND roi.y2
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS queue_counts_mv_cam_bucket_track
+    ON queue_counts_mv (camera_id, bucket, track_id)
+    """,
+    # track_states tables from before the bulk upsert: keep the newest row per
+    # (camera, track, zone) treating NULLs as equal, then rebuild the constraint
+    # NULLS NOT DISTINCT so NULL-zone upserts hit ON CONFLICT
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint c JOIN pg_index i ON i.indexrelid = c.conindid
+        WHERE c.conname = 'unique_track_zone' AND i.indnullsnotdistinct
+      ) THEN
+        DELETE FROM track_states t USING track_states k
+        WHERE t.id <> k.id
+          AND t.camera_id IS NOT DISTINCT FROM k.camera_id
+          AND t.track_id IS NOT DISTINCT FROM k.track_id
+          AND t.zone_id IS NOT DISTINCT FROM k.zone_id
+          AND (COALESCE(t.last_time, '-infinity'), t.id) < (COALESCE(k.last_time, '-infinity'), k.id);
+        ALTER TABLE track_states DROP CONSTRAINT IF EXISTS unique_track_zone;
+        ALTER TABLE track_states ADD CONSTRAINT unique_track_zone
+          UNIQUE NULLS NOT DISTINCT (camera_id, track_id, zone_id);
+      END IF;
+    END $$
+    """,
+    # Bulk upserts send no timestamps: PostgreSQL stamps them (server defaults)
+    "ALTER TABLE track_states ALTER COLUMN created_at SET DEFAULT timezone('utc', now())",
+    "ALTER TABLE track_states ALTER COLUMN updated_at SET DEFAULT timezone('utc', now())",
+    # Replaced by track_states_last_time_brin
+    "DROP INDEX IF EXISTS ix_track_states_last_time",
+]
+
+# detections is RANGE-partitioned by day: retention is a DROP TABLE per day.
+# No DEFAULT partition: rows there would block creating that day's partition
+# and never age out. maintain_detection_partitions keeps a week ahead instead,
+# and every detections writer re-checks daily (ensure_detection_partitions_daily)
+DETECTION_PARTITION_DAYS_AHEAD = 7
+DETECTION_RETENTION_DAYS = int(os.getenv("DETECTION_RETENTION_DAYS", 30))
 
 def get_db_url() -> str:
     user = os.getenv("POSTGRES_USER", "hive_user")
@@ -15,15 +107,107 @@ def get_db_url() -> str:
     db = os.getenv("POSTGRES_DB", "hive_dynamics")
     return f"postgresql+psycopg://{user}:{password}@{host}:{port}/{db}"
 
-def get_db_session():
-    engine = create_engine(get_db_url())
-    SessionLocal = sessionmaker(bind=engine)
-    return SessionLocal()
+# One engine/pool per process, shared by sessions and the maintenance helpers.
+# SQLAlchemy 2 batches psycopg executemany INSERTs into multi-row VALUES
+# ("insertmanyvalues"), up to 1000 rows per statement
+_ENGINE = create_engine(
+    get_db_url(),
+    pool_size=5,
+    pool_pre_ping=True,
+    insertmanyvalues_page_size=1000,
+)
+# expire_on_commit=False: no refresh SELECT for objects touched after each commit
+_Session = sessionmaker(bind=_ENGINE, expire_on_commit=False)
+
+get_db_session = _Session
+
+def detections_relkind(conn):
+    """'p' for the partitioned table, 'r' for a pre-partitioning heap, None if missing."""
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('detections')")
+    ).scalar()
 
 def init_db():
-    engine = create_engine(get_db_url())
-    Base.metadata.create_all(bind=engine)
+    with _ENGINE.begin() as conn:
+        if detections_relkind(conn) == "r":
+            # create_all() would skip the old table and the DDL below would fail on it
+            raise RuntimeError(
+                "detections is not partitioned: run `python -m src.database.migrate_detections` first"
+            )
+        if USE_HLL_DISTINCT:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS hll"))
+    Base.metadata.create_all(bind=_ENGINE)
+    with _ENGINE.begin() as conn:
+        ensure_model_indexes(conn)
+        for ddl in POST_CREATE_DDL:
+            conn.execute(text(ddl))
+        ensure_detection_partitions(conn)
     print("✅ Database tables created")
 
+def ensure_model_indexes(conn):
+    """create_all() skips tables that already exist: add any model index they lack."""
+    for table in (Detection.__table__, TrackState.__table__):
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+def _partition_name(day: date) -> str:
+    return f"detections_p{day:%Y%m%d}"
+
+def create_detection_partitions(conn, first: date, last: date):
+    """Create daily detections partitions for first..last (inclusive)."""
+    day = first
+    while day <= last:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(day)} PARTITION OF detections "
+            f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+        ))
+        day += timedelta(days=1)
+
+def ensure_detection_partitions(conn, days_ahead: int = DETECTION_PARTITION_DAYS_AHEAD):
+    """Create daily detections partitions from today through today + days_ahead."""
+    today = datetime.utcnow().date()
+    create_detection_partitions(conn, today, today + timedelta(days=days_ahead))
+
+_partitions_checked = None  # UTC day this process last ensured partitions
+
+def ensure_detection_partitions_daily():
+    """
+    Writer-side guard, called before each flush: ensures partitions on the
+    first write and then once per UTC day, so ingest does not depend on the
+    scheduler process being up.
+    """
+    global _partitions_checked
+    today = datetime.utcnow().date()
+    if _partitions_checked == today:
+        return
+    try:
+        with _ENGINE.begin() as conn:
+            ensure_detection_partitions(conn)
+        _partitions_checked = today
+    except SQLAlchemyError as e:
+        # e.g. another writer creating the same partition; retried next flush
+        logger.warning(f"Could not ensure detections partitions: {e}")
+
+def drop_expired_detection_partitions(conn, keep_days: int = DETECTION_RETENTION_DAYS):
+    """Drop daily partitions older than keep_days (O(1), no DELETE scan or VACUUM)."""
+    cutoff = datetime.utcnow().date() - timedelta(days=keep_days)
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'detections'::regclass AND c.relname ~ '^detections_p[0-9]{8}$'"
+    )).scalars().all()
+    for name in names:
+        if datetime.strptime(name[-8:], "%Y%m%d").date() < cutoff:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+def maintain_detection_partitions():
+    """Daily job: pre-create upcoming partitions, then apply retention.
+    Separate transactions, so a failed create does not also skip retention."""
+    try:
+        with _ENGINE.begin() as conn:
+            ensure_detection_partitions(conn)
+    finally:
+        with _ENGINE.begin() as conn:
+            drop_expired_detection_partitions(conn)
+
 if __name__ == "__main__":
     init_db()
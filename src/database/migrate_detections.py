@@ -0,0 +1,105 @@
+"""
+One-off migration of an existing detections table to the current schema:
+daily RANGE partitions, JSONB bbox and the generated bbox_cx / bbox_by columns.
+
+    python -m src.database.migrate_detections
+
+Handles both older layouts and is safe to re-run:
+  - a plain (unpartitioned) detections table from init_db.sql or an older
+    create_all(): rows are copied into a new partitioned table;
+  - a partitioned table that still has the old detections_default catch-all:
+    its rows are moved into daily partitions and the default is dropped.
+Both materialized views are dropped as well, so init_db() recreates them
+with the current (time-bounded) definitions. The migration itself runs in
+one transaction.
+"""
+from sqlalchemy import text
+
+from src.database.init_db import (
+    _ENGINE,
+    create_detection_partitions,
+    detections_relkind,
+    ensure_detection_partitions,
+    init_db,
+)
+from src.database.models import Detection
+
+# Old rows stored bbox as text or as a JSON *string* holding the list
+# ("[x1, y1, x2, y2]"); unwrap those into a real jsonb array/object
+_BBOX_JSONB = (
+    "CASE WHEN json_typeof(bbox::text::json) = 'string' "
+    "THEN (bbox::text::json #>> '{}')::jsonb ELSE bbox::text::jsonb END"
+)
+# Generated columns are computed by PostgreSQL and can't be inserted
+_COPY_COLUMNS = "id, camera_id, timestamp, class_name, confidence, bbox, track_id"
+
+
+def _copy_rows(conn, source: str, bbox_expr: str = "bbox") -> int:
+    """Create partitions for every day in `source`, then copy its rows into detections."""
+    first, last = conn.execute(text(
+        f"SELECT min(timestamp)::date, max(timestamp)::date FROM {source}"
+    )).one()
+    if first is not None:
+        create_detection_partitions(conn, first, last)
+    ensure_detection_partitions(conn)  # today onwards, also for NULL timestamps below
+    return conn.execute(text(
+        f"INSERT INTO detections ({_COPY_COLUMNS}) "
+        f"SELECT id, camera_id, COALESCE(timestamp, timezone('utc', now())), "
+        f"class_name, confidence, {bbox_expr}, track_id FROM {source}"
+    )).rowcount
+
+
+def _migrate_unpartitioned(conn) -> int:
+    # Free every name the new table will claim (pkey, id sequence, indexes)
+    conn.execute(text("ALTER TABLE detections RENAME TO detections_legacy"))
+    if conn.execute(text("SELECT to_regclass('detections_pkey')")).scalar():
+        conn.execute(text(
+            "ALTER TABLE detections_legacy RENAME CONSTRAINT detections_pkey TO detections_legacy_pkey"
+        ))
+    if conn.execute(text("SELECT to_regclass('detections_id_seq')")).scalar():
+        conn.execute(text("ALTER SEQUENCE detections_id_seq RENAME TO detections_legacy_id_seq"))
+    indexes = conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'detections_legacy' AND indexname <> 'detections_legacy_pkey'"
+    )).scalars().all()
+    for name in indexes:
+        conn.execute(text(f"DROP INDEX {name}"))
+
+    Detection.__table__.create(conn)
+    moved = _copy_rows(conn, "detections_legacy", _BBOX_JSONB)
+    conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('detections', 'id'), "
+        "COALESCE((SELECT max(id) FROM detections), 0) + 1, false)"
+    ))
+    conn.execute(text("DROP TABLE detections_legacy"))
+    return moved
+
+
+def _drain_default_partition(conn) -> int:
+    if conn.execute(text("SELECT to_regclass('detections_default')")).scalar() is None:
+        return 0
+    conn.execute(text("ALTER TABLE detections DETACH PARTITION detections_default"))
+    moved = _copy_rows(conn, "detections_default")
+    conn.execute(text("DROP TABLE detections_default"))
+    return moved
+
+
+def migrate_detections():
+    with _ENGINE.begin() as conn:
+        # CREATE ... IF NOT EXISTS never updates a view: init_db() rebuilds them below
+        conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS queue_counts_mv"))
+        conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS hourly_unique_person_counts"))
+        kind = detections_relkind(conn)
+        if kind is None:
+            print("ℹ️ No detections table yet: init_db() creates it partitioned")
+        elif kind == "r":
+            moved = _migrate_unpartitioned(conn)
+            print(f"✅ detections rebuilt as daily partitions ({moved} rows copied)")
+        else:
+            moved = _drain_default_partition(conn)
+            print(f"✅ detections_default removed ({moved} rows moved to daily partitions)")
+    init_db()
+
+
+if __name__ == "__main__":
+    migrate_detections()
@@ -1,7 +1,8 @@
 """
 Database models for hive-dynamics CCTV surveillance system.
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Boolean, func, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Boolean, func, UniqueConstraint, Index, text, table, column, Computed
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 
@@ -10,13 +11,54 @@ Base = declarative_base()
 class Detection(Base):
     __tablename__ = "detections"
     
-    id = Column(Integer, primary_key=True)
-    camera_id = Column(String(50), index=True)
-    timestamp = Column(DateTime, index=True, default=datetime.utcnow)
+    # Partitioned by day on timestamp, so the partition key is part of the PK
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    camera_id = Column(String(50))  # leading column of the composite indexes below
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)  # BRIN-indexed below
     class_name = Column(String(50))
     confidence = Column(Float)
-    bbox = Column(JSON)  # {"x1":10,"y1":20,"x2":100,"y2":200}
+    bbox = Column(JSONB)  # [x1,y1,x2,y2] or {"x1":10,"y1":20,"x2":100,"y2":200}
     track_id = Column(Integer, nullable=True)
+    # bbox bottom-center, computed by PostgreSQL from list or dict bbox
+    bbox_cx = Column(
+        Float,
+        Computed(
+            "(COALESCE(bbox->>'x1', bbox->>0)::float"
+            " + COALESCE(bbox->>'x2', bbox->>2)::float) / 2",
+            persisted=True,
+        ),
+    )
+    bbox_by = Column(Float, Computed("COALESCE(bbox->>'y2', bbox->>3)::float", persisted=True))
+
+    __table_args__ = (
+        # Each index is written on every insert, so each one serves a named reader
+        # fire_agent window scan: only fire/smoke rows, (camera, time) ordered
+        Index(
+            "det_fire_smoke",
+            "camera_id",
+            "timestamp",
+            postgresql_where=text("class_name IN ('fire', 'smoke')"),
+        ),
+        # All-camera time windows (track_state_processor, view refreshes) within a
+        # daily partition: block-range index instead of a per-row btree
+        Index(
+            "detections_ts_brin",
+            "timestamp",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ),
+        # Per-camera person windows (PeakHourAgent, OvercrowdingAgent, QueueAgent's
+        # ROI count): index-only on tracked persons, ROI tested on the INCLUDE columns
+        Index(
+            "detections_person_recent",
+            "camera_id",
+            timestamp.desc(),
+            postgresql_include=["track_id", "bbox_cx", "bbox_by"],
+            postgresql_where=text("class_name = 'person' AND track_id IS NOT NULL"),
+        ),
+        # Daily partitions are created/dropped by init_db.maintain_detection_partitions
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
 class Alert(Base):
     __tablename__ = "alerts"
@@ -60,17 +102,61 @@ class TrackState(Base):
     zone_id = Column(Integer, index=True, nullable=True)  # from zones table
     class_name = Column(String(50), index=True)  # person, vehicle
     enter_time = Column(DateTime, index=True)
-    last_time = Column(DateTime, index=True)
+    last_time = Column(DateTime)  # BRIN-indexed below
     total_dwell_sec = Column(Integer)  # (last_time - enter_time).seconds
     detection_count = Column(Integer)
     avg_speed = Column(Float, nullable=True)  # pixels/sec or m/s
     avg_bbox_area = Column(Float, nullable=True)
     status = Column(String(20), default="active")  # active, loitering, exited
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Stamped by PostgreSQL (naive UTC like the other columns): bulk upserts send no timestamps
+    created_at = Column(DateTime, server_default=func.timezone("utc", func.now()))
+    updated_at = Column(
+        DateTime,
+        server_default=func.timezone("utc", func.now()),
+        onupdate=func.timezone("utc", func.now()),
+    )
     
     __table_args__ = (
-        UniqueConstraint('camera_id', 'track_id', 'zone_id', name='unique_track_zone'),
+        # NULLS NOT DISTINCT (PG15+): tracks without a zone still hit ON CONFLICT
+        UniqueConstraint(
+            'camera_id', 'track_id', 'zone_id',
+            name='unique_track_zone',
+            postgresql_nulls_not_distinct=True,
+        ),
+        # loitering_agent: latest active row per (camera, track), index-only
+        Index(
+            "ix_track_states_active_latest",
+            "camera_id",
+            "track_id",
+            last_time.desc(),
+            postgresql_include=[
+                "zone_id", "class_name", "total_dwell_sec", "detection_count", "avg_speed",
+            ],
+            postgresql_where=text("status = 'active'"),
+        ),
+        # loitering window scan (last_time >= cutoff): rows are written in time
+        # order, so a BRIN block-range index replaces the per-row btree
+        Index(
+            "track_states_last_time_brin",
+            "last_time",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ),
     )
 
+# Materialized views: created/refreshed by init_db.py, not by create_all()
+hourly_unique_person_counts = table(
+    "hourly_unique_person_counts",
+    column("camera_id", String),
+    column("h", DateTime),
+    column("n", Integer),
+)
+
+queue_counts_mv = table(
+    "queue_counts_mv",
+    column("camera_id", String),
+    column("bucket", DateTime),
+    column("track_id", Integer),
+)
+
 print("✅ All models loaded - ready for video_processor")
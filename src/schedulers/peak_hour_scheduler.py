@@ -1,27 +1,63 @@
 import asyncio
 import logging
-import time
+from typing import List
 
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import distinct, select
 
 from src.agents.peak_hour_agent import PeakHourAgent
+from src.database.init_db import get_db_session, maintain_detection_partitions
+from src.database.models import Detection
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# One agent (engine pool, compiled graph, LLM/Redis clients) for the process
+agent = None
+cameras: List[str] = ["CAM_001"]  # used until detections name any camera
+
+
+def load_cameras():
+    """Cameras that have produced detections; refreshed daily, not per tick."""
+    global cameras
+    session = get_db_session()
+    try:
+        found = session.execute(select(distinct(Detection.camera_id))).scalars().all()
+    finally:
+        session.close()
+    if found:
+        cameras = sorted(c for c in found if c)
+    logger.info("Peak-hour cameras: %s", cameras)
+
+
+async def _run_all(camera_ids: List[str]):
+    return await asyncio.gather(*(agent.run(cam_id) for cam_id in camera_ids))
+
+
 def run_peak_agent_for_all_cameras():
-    agent = PeakHourAgent()
-    cameras = ["CAM_001"]  # later: load from DB/config
+    global agent
+    # Each run refreshes hourly_unique_person_counts itself before reading it
+    if agent is None:
+        agent = PeakHourAgent()
 
-    for cam_id in cameras:
-        alerts = asyncio.run(agent.run(cam_id))
+    # All cameras concurrently in one event loop
+    results = asyncio.run(_run_all(cameras))
+    for cam_id, alerts in zip(cameras, results):
         logger.info("PeakHourAgent run for %s → %d alerts", cam_id, len(alerts))
 
 
 if __name__ == "__main__":
-    scheduler = BackgroundScheduler(timezone="Asia/Kolkata")
+    scheduler = BlockingScheduler(timezone="Asia/Kolkata")
+    load_cameras()
+    # Pick up newly added cameras once a day
+    scheduler.add_job(
+        load_cameras,
+        CronTrigger(hour=0, minute=50),
+        id="load_cameras_job",
+        replace_existing=True,
+    )
     # Run at the start of every hour
     scheduler.add_job(
         run_peak_agent_for_all_cameras,
@@ -29,13 +65,18 @@ if __name__ == "__main__":
         id="peak_hour_job",
         replace_existing=True,
     )
+    # Daily detections partitions: create the coming week, drop expired days
+    scheduler.add_job(
+        maintain_detection_partitions,
+        CronTrigger(hour=1, minute=15),
+        id="detection_partitions_job",
+        replace_existing=True,
+    )
 
-    scheduler.start()
     logger.info("🔁 Peak hour scheduler started (runs every hour at :00)")
 
+    # Runs the jobs on this thread until interrupted
     try:
-        while True:
-            time.sleep(5)
+        scheduler.start()
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
         logger.info("⏹️ Scheduler stopped")